@@ -0,0 +1,121 @@
+import os
+import json
+import struct
+import hashlib
+import pygame
+
+class AssetRegistry:
+    """Process-wide cache, every asset is loaded once and the same object is handed out afterwards.
+    Surfaces from the registry are shared, so they must never be drawn onto"""
+    def __init__(self):
+        self.assets = {}
+
+    def get(self, key, load):
+        asset = self.assets.get(key)
+        if asset is None:
+            asset = load()
+            self.assets[key] = asset
+        return asset
+
+    def clear(self):
+        self.assets.clear()
+
+registry = AssetRegistry()
+
+def list_numbered_images(dirname):
+    """Returns a {number: path} dict of the N.png images in a directory"""
+    images = {}
+    for entry in os.scandir(dirname):
+        (name, ext) = os.path.splitext(entry.name)
+        if ext == ".png" and name.isdigit():
+            images[int(name)] = entry.path
+    return images
+
+def pack_atlas(images):
+    """Packs images side by side into a single surface, returns the atlas and a subsurface for each image"""
+    width = sum(image.get_width() for image in images)
+    height = max((image.get_height() for image in images), default=0)
+    atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+    if pygame.display.get_surface() is not None:
+        atlas = atlas.convert_alpha()
+
+    rects = []
+    x = 0
+    for image in images:
+        rect = atlas.blit(image, (x, 0))
+        rects.append(rect)
+        x += image.get_width()
+
+    return (atlas, [atlas.subsurface(rect) for rect in rects])
+
+# Scaled images are cached on disk as raw RGBA so that later launches skip decoding and scaling.
+# Set PLATFORMER_ASSET_CACHE_DIR to an empty string to disable the cache
+ASSET_CACHE_DIR = os.environ.get("PLATFORMER_ASSET_CACHE_DIR", ".cache/assets")
+ASSET_CACHE_MAGIC = b"PIMG"
+ASSET_CACHE_VERSION = 1
+ASSET_CACHE_HEADER = struct.Struct("<4sHII")
+
+class DiskImageCache:
+    def __init__(self, dirname):
+        self.dirname = dirname
+        self.index_filename = os.path.join(dirname, "index.json")
+
+        # Source path -> [mtime, size, hash], so that unchanged files don't have to be hashed again
+        self.index = {}
+        if dirname:
+            try:
+                with open(self.index_filename) as file:
+                    self.index = json.load(file)
+            except (OSError, ValueError):
+                pass
+
+    def get_source_hash(self, filename):
+        stat = os.stat(filename)
+        entry = self.index.get(filename)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2]
+
+        with open(filename, "rb") as file:
+            source_hash = hashlib.sha1(file.read()).hexdigest()
+        self.index[filename] = [stat.st_mtime_ns, stat.st_size, source_hash]
+        self.write(self.index_filename, json.dumps(self.index).encode())
+
+        return source_hash
+
+    def load(self, filename, scale, load):
+        """Returns the scaled image from the cache, calling load() to create it if it is missing or out of date"""
+        if not self.dirname:
+            return load()
+
+        cache_filename = os.path.join(self.dirname, f"{self.get_source_hash(filename)}-{scale}.rgba")
+        try:
+            with open(cache_filename, "rb") as file:
+                data = file.read()
+            (magic, version, width, height) = ASSET_CACHE_HEADER.unpack_from(data)
+            if magic == ASSET_CACHE_MAGIC and version == ASSET_CACHE_VERSION and len(data) == ASSET_CACHE_HEADER.size + width * height * 4:
+                image = pygame.image.frombuffer(memoryview(data)[ASSET_CACHE_HEADER.size:], (width, height), "RGBA")
+                if pygame.display.get_surface() is not None:
+                    image = image.convert_alpha()
+                return image
+        except (OSError, struct.error):
+            pass
+
+        image = load()
+        header = ASSET_CACHE_HEADER.pack(ASSET_CACHE_MAGIC, ASSET_CACHE_VERSION, image.get_width(), image.get_height())
+        self.write(cache_filename, header + pygame.image.tobytes(image, "RGBA"))
+
+        return image
+
+    def write(self, filename, data):
+        # Write to a temporary file first so that a crash never leaves a half written entry behind.
+        # The cache is only an optimization, so failing to write it is not an error
+        try:
+            os.makedirs(self.dirname, exist_ok=True)
+            temp_filename = f"{filename}.{os.getpid()}.tmp"
+            with open(temp_filename, "wb") as file:
+                file.write(data)
+            os.replace(temp_filename, filename)
+        except OSError:
+            pass
+
+disk_cache = DiskImageCache(ASSET_CACHE_DIR)
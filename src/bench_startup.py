@@ -0,0 +1,71 @@
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+# Measures how long a launch takes to load the game's images, without the asset cache, with an empty (cold) cache
+# and with a filled (warm) cache. Every launch is a fresh process, run from the repository root:
+#   python src/bench_startup.py --runs 5
+
+def load_startup_assets():
+    from game import load_image_scaled, load_image_scaled_default, load_tileset, load_animations, Background
+
+    load_tileset("assets/super_mango/tileset")
+    for filename in ["assets/super_mango/player", "assets/super_mango/bird", "assets/super_mango/spider"]:
+        load_animations(filename)
+    Background("assets/super_mango/Forest_Background_0.png")
+    load_image_scaled_default("assets/super_mango/Coin.png")
+    load_image_scaled("assets/super_mango/Star_Yellow.png", 4)
+    load_image_scaled("assets/heart/empty.png", 4)
+    load_image_scaled("assets/heart/full.png", 4)
+
+def run_child():
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    pygame.display.init()
+    pygame.display.set_mode((1, 1))
+
+    begin = time.perf_counter()
+    load_startup_assets()
+    print(time.perf_counter() - begin)
+
+def launch(cache_dir):
+    env = dict(os.environ, PLATFORMER_ASSET_CACHE_DIR=cache_dir, PYGAME_HIDE_SUPPORT_PROMPT="1")
+    begin = time.perf_counter()
+    output = subprocess.run([sys.executable, __file__, "--child"], env=env, check=True, capture_output=True, text=True).stdout
+    return (time.perf_counter() - begin, float(output.split()[-1]))
+
+def report(name, results):
+    results.sort()
+    (total, load) = results[len(results) // 2]
+    print(f"{name:10} launch {total * 1000:8.1f} ms   asset loading {load * 1000:8.1f} ms   (median of {len(results)})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark cold and warm asset loading at startup")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child()
+        sys.exit()
+
+    cache_dir = tempfile.mkdtemp(prefix="platformer-asset-cache-")
+    try:
+        uncached = [launch("") for _ in range(args.runs)]
+
+        cold = []
+        for _ in range(args.runs):
+            shutil.rmtree(cache_dir, ignore_errors=True)
+            cold.append(launch(cache_dir))
+
+        warm = [launch(cache_dir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    report("no cache", uncached)
+    report("cold", cold)
+    report("warm", warm)
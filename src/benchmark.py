@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+from time import perf_counter
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from game import *
+
+# Benchmarks the hot paths of the game without a display, run from the repository root:
+#   python src/benchmark.py --save baseline.json
+#   python src/benchmark.py --baseline baseline.json
+
+BENCHMARK_MAP_WIDTHS = [1000, 10000, 100000]
+BENCHMARK_ENEMY_COUNTS = [10, 100, 500]
+
+def measure(function, repeat, number=1):
+    """Calls function number times per run, returns the per-call milliseconds of every run"""
+    times = []
+    for _ in range(repeat):
+        begin = perf_counter()
+        for _ in range(number):
+            function()
+        times.append((perf_counter() - begin) * 1000.0 / number)
+    return times
+
+class Benchmarks:
+    """Per-run times by benchmark name. Only the benchmarks whose name contains the filter are measured"""
+    def __init__(self, repeat, filter=""):
+        self.repeat = repeat
+        self.filter = filter
+        self.times = {}
+
+    def wants(self, name):
+        return self.filter in name
+
+    def run(self, name, function, number=1):
+        if self.wants(name):
+            self.times[name] = measure(function, self.repeat, number)
+
+def write_synthetic_map(filename, width, seed=0):
+    # Empty sky over a ground of random tiles with the occasional pillar
+    rng = random.Random(seed)
+    with open(filename, "w") as file:
+        for y in range(CHUNK_HEIGHT):
+            if y < CHUNK_HEIGHT - 8:
+                row = "".join("1" if y >= CHUNK_HEIGHT - 10 and rng.random() < 0.05 else "0" for _ in range(width))
+            else:
+                row = "".join(rng.choice("123456789") for _ in range(width))
+            file.write(row + "\n")
+
+def bench_map_parsing(benchmarks, temp_dir):
+    sweep_width = BENCHMARK_MAP_WIDTHS[1]
+    sweep_name = f"chunk_manager/camera_sweep/{sweep_width}"
+    for width in BENCHMARK_MAP_WIDTHS:
+        names = [f"map/parse_text/{width}", f"map/open_streaming/{width}", f"map/open_binary/{width}"]
+        if not any(benchmarks.wants(name) for name in names) and not (width == sweep_width and benchmarks.wants(sweep_name)):
+            continue # Writing the big maps takes a while
+
+        text_filename = os.path.join(temp_dir, f"{width}.txt")
+        binary_filename = os.path.join(temp_dir, f"{width}.bin")
+        write_synthetic_map(text_filename, width)
+        write_binary_map(binary_filename, Map(text_filename), chunk_aligned=True)
+
+        benchmarks.run(names[0], lambda: Map(text_filename))
+        benchmarks.run(names[1], lambda: StreamingMap(text_filename))
+        benchmarks.run(names[2], lambda: BinaryMap(binary_filename))
+
+    # Streaming chunks of a long level in, a few camera steps per chunk
+    if benchmarks.wants(sweep_name):
+        map = StreamingMap(os.path.join(temp_dir, f"{sweep_width}.txt"))
+        source = MapChunkSource(map, EntityManifest(None, CHUNK_WIDTH * TILE_SIZE))
+        def sweep_camera():
+            chunk_manager = ChunkManager(source)
+            for x in range(0, map.width * TILE_SIZE, CHUNK_WIDTH * TILE_SIZE // 4):
+                chunk_manager.update((x, 0))
+        benchmarks.run(sweep_name, sweep_camera)
+
+def bench_chunks(benchmarks, map_filename):
+    screen = pygame.display.get_surface()
+    tileset = load_tileset("assets/super_mango/tileset")
+    map = load_map(map_filename)
+    source = MapChunkSource(map, EntityManifest(None, CHUNK_WIDTH * TILE_SIZE))
+
+    # Building and baking a chunk, then drawing it once it is baked
+    benchmarks.run("chunk/load", lambda: Chunk(5, source.get_tiles(5)), 100)
+    chunk = Chunk(5, source.get_tiles(5))
+    camera_pos = (5 * CHUNK_WIDTH * TILE_SIZE, CHUNK_HEIGHT * TILE_SIZE - SCREEN_HEIGHT / 2)
+    benchmarks.run("chunk/bake", lambda: chunk.bake(tileset), 10)
+    benchmarks.run("chunk/draw_with_tileset", lambda: chunk.draw_with_tileset(screen, camera_pos, tileset), 100)
+
+    # Streaming chunks in while the camera sweeps over the whole level
+    def sweep_camera():
+        chunk_manager = ChunkManager(source)
+        for x in range(0, map.width * TILE_SIZE, TILE_SIZE):
+            chunk_manager.update((x, camera_pos[1]))
+    benchmarks.run("chunk_manager/camera_sweep", sweep_camera)
+
+    # Generating endless chunks, then getting them again once they are memoized
+    procedural = ProceduralChunkSource(1, TILE_SIZE)
+    benchmarks.run("chunk/procedural_generate", lambda: procedural.generate(5), 100)
+    benchmarks.run("chunk/procedural_get_tiles", lambda: procedural.get_tiles(5), 100)
+
+def bench_collision(benchmarks, map_filename):
+    world = World(map_filename)
+
+    # A spider walking back and forth along the ground, one MovableObject.update per call
+    spider = Spider()
+    spider.position = [500.0, 1000.0]
+    benchmarks.run("collision/update", lambda: spider.update(world, SIMULATION_DT), 1000)
+    benchmarks.run("collision/sweep", lambda: spider.sweep(world, 0, 5.0), 1000)
+
+def bench_frames(benchmarks, map_filename):
+    screen = pygame.display.get_surface()
+    background = Background("assets/super_mango/Forest_Background_0.png")
+    for count in BENCHMARK_ENEMY_COUNTS:
+        if not benchmarks.wants(f"frame/enemies/{count}"):
+            continue
+        simulation = Simulation(map_filename)
+
+        # Spread the enemies over the first screen of the level, where the camera stays
+        rng = random.Random(count)
+        simulation.spiders = simulation.enemy_groups["spider"] = make_enemy_group(Spider, count)
+        for _ in range(count):
+            simulation.spiders.spawn([rng.uniform(0.0, SCREEN_WIDTH), rng.uniform(900.0, 1200.0)])
+        simulation.enemies = list(simulation.enemy_groups.values())
+
+        def frame():
+            simulation.step(Inputs(right=simulation.ticks % 120 < 60, left=simulation.ticks % 120 >= 60))
+            background.draw(screen, simulation.get_camera_pos())
+            simulation.draw(screen)
+        benchmarks.run(f"frame/enemies/{count}", frame, 20)
+
+def summarize(times):
+    times = sorted(times)
+    return {"median_ms": round(times[len(times) // 2], 5), "min_ms": round(times[0], 5), "runs": len(times)}
+
+def compare(results, baseline, tolerance):
+    """Prints how each benchmark changed against the baseline, returns the names of the ones that regressed or are
+    in the baseline but weren't run"""
+    regressions = [name for name in baseline if name not in results]
+    for name in regressions:
+        print(f"{name:40} {'':10}      (missing)")
+
+    for (name, result) in results.items():
+        if name not in baseline:
+            print(f"{name:40} {result['median_ms']:10.4f} ms   (new)")
+            continue
+
+        before = baseline[name]["median_ms"]
+        change = result["median_ms"] / before - 1.0 if before > 0.0 else 0.0
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:40} {result['median_ms']:10.4f} ms   {change * 100.0:+7.1f}%{flag}")
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark rendering, collision, chunk streaming and map loading")
+    parser.add_argument("--map", default="assets/maps/1.txt", help="level used by the chunk, collision and frame benchmarks")
+    parser.add_argument("--repeat", type=int, default=7, help="runs per benchmark, the median is reported")
+    parser.add_argument("--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--save", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="compare with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="slowdown against the baseline that counts as a regression")
+    args = parser.parse_args()
+
+    pygame.display.init()
+    pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+
+    benchmarks = Benchmarks(args.repeat, args.filter)
+    with tempfile.TemporaryDirectory(prefix="platformer-benchmark-") as temp_dir:
+        bench_map_parsing(benchmarks, temp_dir)
+        bench_chunks(benchmarks, args.map)
+        bench_collision(benchmarks, args.map)
+        bench_frames(benchmarks, args.map)
+
+    if not benchmarks.times:
+        print(f"No benchmark matches {args.filter!r}", file=sys.stderr)
+        sys.exit(2)
+    results = {name: summarize(run_times) for (name, run_times) in benchmarks.times.items()}
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = {name: result for (name, result) in json.load(file).items() if args.filter in name}
+        regressions = compare(results, baseline, args.tolerance)
+    else:
+        for (name, result) in results.items():
+            print(f"{name:40} {result['median_ms']:10.4f} ms")
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=4)
+
+    if regressions:
+        sys.exit(1)
@@ -0,0 +1,31 @@
+import os
+import shutil
+import argparse
+
+from level import *
+
+# Compiles text levels into the binary level format, e.g.
+#   python src/compile_maps.py assets/maps/*.txt --chunk-aligned
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile text levels into binary levels")
+    parser.add_argument("maps", nargs="+", help="text level files")
+    parser.add_argument("--chunk-aligned", action="store_true", help="pad the level so that every chunk can be loaded without copying")
+    parser.add_argument("--output-dir", help="where to write the binary levels, defaults to next to each text level")
+    args = parser.parse_args()
+
+    for filename in args.maps:
+        (base_name, _) = os.path.splitext(os.path.basename(filename))
+        output_dir = args.output_dir or os.path.dirname(filename)
+        output_filename = os.path.join(output_dir, base_name + ".bin")
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        map = load_map(filename)
+        write_binary_map(output_filename, map, args.chunk_aligned)
+        print(f"{filename} -> {output_filename} ({map.width}x{map.height})")
+
+        # The entity manifest has to stay next to the level
+        manifest_filename = get_manifest_filename(filename)
+        output_manifest_filename = get_manifest_filename(output_filename)
+        if os.path.exists(manifest_filename) and os.path.abspath(manifest_filename) != os.path.abspath(output_manifest_filename):
+            shutil.copyfile(manifest_filename, output_manifest_filename)
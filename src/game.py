@@ -1,11 +1,29 @@
 from math import *
 
 import os
+import sys
+import copy
 import json
+import zlib
+import struct
 import pygame
+from array import array
+from collections import OrderedDict
 from pygame import font
 
+try:
+    import numpy
+except ImportError: # Enemies are then updated one at a time, see make_enemy_group
+    numpy = None
+
 from constants import *
+from level import *
+from assets import *
+from spatial import SpatialHash
+from prefetch import ChunkPrefetcher
+from procedural import ProceduralChunkSource
+from renderer import DirtyRenderer
+from text import HudText
 
 # Helpers
 def clamp(x, a, b):
@@ -18,8 +36,22 @@ GREEN = (0, 255, 0)
 RED = (255, 0, 0)
 BLUE = (0, 0, 255)
 
+# World units per pixel of the surface the world is drawn onto. 1 draws straight to the screen, IMAGE_SCALE draws
+# the source art at its native size into a small framebuffer that is upscaled once per frame, see play_game.
+# Sizes and positions in the world never depend on it
+RENDER_DIVISOR = 1
+
+def set_render_divisor(divisor):
+    global RENDER_DIVISOR
+    if IMAGE_SCALE % divisor != 0:
+        raise ValueError(f"Render divisor {divisor} doesn't divide the image scale {IMAGE_SCALE}")
+    RENDER_DIVISOR = divisor
+
+def get_framebuffer_size():
+    return (SCREEN_WIDTH // RENDER_DIVISOR, SCREEN_HEIGHT // RENDER_DIVISOR)
+
 def world_to_screen(pos, camera_pos):
-    return (pos[0] - camera_pos[0] + SCREEN_WIDTH / 2, pos[1] - camera_pos[1] + SCREEN_HEIGHT / 2)
+    return ((pos[0] - camera_pos[0] + SCREEN_WIDTH / 2) / RENDER_DIVISOR, (pos[1] - camera_pos[1] + SCREEN_HEIGHT / 2) / RENDER_DIVISOR)
 
 FRICTION = 0.07
 GRAVITY = 2500
@@ -27,126 +59,207 @@ PLAYER_SPEED = 1800
 PLAYER_JUMP_HEIGHT = 800
 
 IMAGE_SCALE = 3
-NONE_TILE = 0
 
-def load_image_scaled(filename, scale):
-    image = pygame.image.load(filename).convert_alpha()
-    size = [image.get_width() * scale, image.get_height() * scale]
+def decode_image_scaled(filename, scale):
+    image = pygame.image.load(filename)
+    if pygame.display.get_surface() is not None: # Headless simulations have no display to convert to
+        image = image.convert_alpha()
+    size = [round(image.get_width() * scale), round(image.get_height() * scale)]
     image = pygame.transform.scale(image, size)
 
     return image
 
+def load_image_scaled_unshared(filename, scale):
+    return disk_cache.load(filename, scale, lambda: decode_image_scaled(filename, scale))
+
+def load_image_scaled(filename, scale):
+    return registry.get(("image", filename, scale), lambda: load_image_scaled_unshared(filename, scale))
+
 def load_image_scaled_default(filename):
-    return load_image_scaled(filename, IMAGE_SCALE)
+    return load_image_scaled_render(filename, IMAGE_SCALE)
+
+def load_image_scaled_render(filename, scale):
+    """Loads an image for drawing into the world, scale is how much bigger than the source it is in world units"""
+    return load_image_scaled(filename, scale if RENDER_DIVISOR == 1 else scale / RENDER_DIVISOR)
+
+def get_image_world_size(filename, scale):
+    """Size in world units of an image loaded with load_image_scaled_render, whatever the render divisor"""
+    (width, height) = registry.get(("size", filename), lambda: pygame.image.load(filename).get_size())
+    return (width * scale, height * scale)
 
 class Tileset:
     def __init__(self, filename):
-        count = 0
-        for entry in os.scandir(filename):
-            if entry.path.split(".")[1] == "png":
-                count += 1
-
-        self.images = [None] * (count + 1) # + 1 because of the empty image number 0
-        for entry in os.scandir(filename):
-            base_name = os.path.basename(entry.path)
-            (name, ext) = base_name.split(".")
-            if ext == "png":
-                self.images[int(name)] = load_image_scaled_default(entry.path)
+        paths = list_numbered_images(filename)
+        self.images = [None] * (max(paths, default=0) + 1) # Image number 0 is the empty tile
+        for (number, path) in paths.items():
+            self.images[number] = load_image_scaled_default(path)
 
     def get_image(self, tile):
         return self.images[tile]
 
-class Map:
-    def __init__(self, filename):
-        self.tiles = []
-        with open(filename) as file:
-            for line in file.readlines():
-                line = line.strip()
-                tile_row = [None] * len(line)
-                for i in range(len(line)):
-                    tile_row[i] = int(line[i])
-                self.tiles.append(tile_row)
-
-    def get_tile(self, x, y):
-        if y < 0 or y >= len(self.tiles):
-            return NONE_TILE
-
-        tile_row = self.tiles[y]
-        if x < 0 or x >= len(tile_row):
-            return NONE_TILE
-
-        return tile_row[x]
+def load_tileset(filename):
+    return registry.get(("tileset", filename, RENDER_DIVISOR), lambda: Tileset(filename))
 
 TILE_SIZE = 16 * IMAGE_SCALE
-CHUNK_WIDTH = 8
-CHUNK_HEIGHT = 32
 
 class Chunk:
-    def __init__(self, x, map):
+    def __init__(self, x, tiles):
         self.x = x
+        self.tiles = tiles # Column-major, see Map.get_columns
 
-        self.tiles = [0] * CHUNK_WIDTH * CHUNK_HEIGHT
-        self.load(map)
-
-    def load(self, map):
-        for tile_x in range(CHUNK_WIDTH):
-            for tile_y in range(CHUNK_HEIGHT):
-                x = self.x * CHUNK_WIDTH + tile_x
-                tile = map.get_tile(x, tile_y)
-                self.set_tile(tile_x, tile_y, tile)
+        # Tiles are baked into a single surface on first draw, see bake()
+        self.surface = None
+        self.surface_top = 0
+        self.baked = False
 
     def get_tile(self, rel_tile_x, rel_tile_y):
-        return self.tiles[rel_tile_y * CHUNK_WIDTH + rel_tile_x]
+        return self.tiles[rel_tile_x * CHUNK_HEIGHT + rel_tile_y]
 
     def set_tile(self, rel_tile_x, rel_tile_y, tile):
-        self.tiles[rel_tile_y * CHUNK_WIDTH + rel_tile_x] = tile
-
-    def draw_with_tileset(self, surface, camera_pos, tileset):
+        if isinstance(self.tiles, memoryview):
+            # Tiles of a compiled level are a read-only view into the level file
+            self.tiles = array(self.tiles.format, self.tiles)
+        self.tiles[rel_tile_x * CHUNK_HEIGHT + rel_tile_y] = tile
+        self.invalidate()
+
+    def invalidate(self):
+        self.surface = None
+        self.baked = False
+
+    def bake(self, tileset):
+        self.baked = True
+        self.surface = None
+
+        # Only allocate the rows that actually contain tiles
+        rows = [y for y in range(CHUNK_HEIGHT) if any(self.get_tile(x, y) != NONE_TILE for x in range(CHUNK_WIDTH))]
+        if not rows:
+            return
+
+        self.surface_top = rows[0]
+        height = rows[-1] + 1 - rows[0]
+        tile_size = TILE_SIZE // RENDER_DIVISOR
+        self.surface = pygame.Surface((CHUNK_WIDTH * tile_size, height * tile_size), pygame.SRCALPHA).convert_alpha()
         for x in range(CHUNK_WIDTH):
-            for y in range(CHUNK_HEIGHT):
+            for y in rows:
                 tile = self.get_tile(x, y)
-                if tile != 0:
-                    rect = self.get_tile_rect(x, y)
-                    rect.topleft = world_to_screen(rect.topleft, camera_pos)
-                    surface.blit(tileset.get_image(tile), rect.topleft)
+                if tile != NONE_TILE:
+                    self.surface.blit(tileset.get_image(tile), (x * tile_size, (y - self.surface_top) * tile_size))
 
-    def get_tile_rect(self, tile_x, tile_y):
-        return pygame.Rect((self.x * CHUNK_WIDTH + tile_x) * TILE_SIZE, tile_y * TILE_SIZE, TILE_SIZE, TILE_SIZE)
+    def get_memory_size(self):
+        size = sys.getsizeof(self.tiles)
+        if self.surface is not None:
+            size += self.surface.get_pitch() * self.surface.get_height()
+        return size
 
-    def get_tile_x_range(self, left, right):
-        begin = clamp(floor(left / TILE_SIZE) - self.x * CHUNK_WIDTH, 0, CHUNK_WIDTH)
-        end = clamp(ceil(right / TILE_SIZE) - self.x * CHUNK_WIDTH, 0, CHUNK_WIDTH)
-        return (begin, end)
+    def draw_with_tileset(self, surface, camera_pos, tileset):
+        if not self.baked:
+            self.bake(tileset)
+        if self.surface is not None:
+            pos = (self.x * CHUNK_WIDTH * TILE_SIZE, self.surface_top * TILE_SIZE)
+            surface.blit(self.surface, world_to_screen(pos, camera_pos))
 
-    def get_tile_y_range(self, top, bottom):
-        begin = clamp(floor(top / TILE_SIZE), 0, CHUNK_HEIGHT)
-        end = clamp(ceil(bottom / TILE_SIZE), 0, CHUNK_HEIGHT)
-        return (begin, end)
+CHUNK_CACHE_CAPACITY = 16
+CHUNK_CACHE_KEEP_MARGIN = 2 # Chunks this close to the visible range are never evicted and have their entities spawned
 
 class ChunkManager:
-    def __init__(self, map):
-        self.map = map
-        self.tileset = Tileset("assets/super_mango/tileset")
-        self.chunks = {}
+    def __init__(self, source, capacity=CHUNK_CACHE_CAPACITY):
+        self.source = source # See MapChunkSource
+        self.tileset = None # Loaded on first draw, headless simulations never need it
+        self.capacity = capacity
+        self.chunks = OrderedDict() # Least recently used first
+        self.visible = (0, 0)
+        self.kept = (0, 0) # The visible range and its margin
+        self.ahead = (0, 0) # Chunks a ChunkPrefetcher is loading, kept like the visible ones
+
+        # Called with the chunk x of every chunk entering and leaving the kept range. This only depends on the
+        # camera, unlike the chunks that happen to be in the cache, so a simulation using it stays deterministic
+        self.enter_listeners = []
+        self.leave_listeners = []
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def update(self, camera_pos):
-        visible = self.get_visible_chunk_range(camera_pos)
-        for chunk_x in range(visible[0], visible[1]):
+        self.visible = self.get_visible_chunk_range(camera_pos)
+        for chunk_x in range(self.visible[0], self.visible[1]):
             self.ensure_chunk(chunk_x)
 
+        kept = (self.visible[0] - CHUNK_CACHE_KEEP_MARGIN, self.visible[1] + CHUNK_CACHE_KEEP_MARGIN)
+        if kept != self.kept:
+            (old, self.kept) = (self.kept, kept)
+            for chunk_x in range(old[0], old[1]):
+                if not kept[0] <= chunk_x < kept[1]:
+                    for listener in self.leave_listeners:
+                        listener(chunk_x)
+            for chunk_x in range(kept[0], kept[1]):
+                if not old[0] <= chunk_x < old[1]:
+                    for listener in self.enter_listeners:
+                        listener(chunk_x)
+
+        self.evict()
+
     def draw(self, surface, camera_pos):
+        if self.tileset is None:
+            self.tileset = load_tileset("assets/super_mango/tileset")
+
         visible = self.get_visible_chunk_range(camera_pos)
         for chunk_x in range(visible[0], visible[1]):
-            chunk = self.chunks[chunk_x]
+            chunk = self.chunks.get(chunk_x)
+            if chunk is None: # Drawing between steps can show a chunk the last update didn't ask for
+                chunk = self.ensure_chunk(chunk_x)
             chunk.draw_with_tileset(surface, camera_pos, self.tileset)
 
     def ensure_chunk(self, chunk_x):
-        if not chunk_x in self.chunks:
-            self.chunks[chunk_x] = Chunk(chunk_x, self.map)
+        chunk = self.chunks.get(chunk_x)
+        if chunk is None:
+            # Evicted chunks are simply rebuilt from the source
+            self.misses += 1
+            chunk = Chunk(chunk_x, self.load_tiles(chunk_x))
+            self.chunks[chunk_x] = chunk
+        else:
+            self.hits += 1
+            self.chunks.move_to_end(chunk_x)
+
+        return chunk
+
+    def load_tiles(self, chunk_x):
+        # Safe to call from other threads
+        return self.source.get_tiles(chunk_x)
+
+    def add_chunk(self, chunk_x, tiles):
+        if chunk_x in self.chunks: # Got built synchronously in the meantime
+            return False
+
+        self.chunks[chunk_x] = Chunk(chunk_x, tiles)
+        return True
 
     def get_chunk(self, chunk_x):
-        self.ensure_chunk(chunk_x)
-        return self.chunks[chunk_x]
+        # Collision reads chunks all the time, so only building a missing one touches the LRU order and the stats
+        chunk = self.chunks.get(chunk_x)
+        if chunk is None:
+            chunk = self.ensure_chunk(chunk_x)
+        return chunk
+
+    def get_tile(self, tile_x, tile_y):
+        if tile_y < 0 or tile_y >= CHUNK_HEIGHT:
+            return NONE_TILE
+
+        chunk_x = tile_x // CHUNK_WIDTH
+        return self.get_chunk(chunk_x).get_tile(tile_x - chunk_x * CHUNK_WIDTH, tile_y)
+
+    def evict(self):
+        for chunk_x in list(self.chunks):
+            if len(self.chunks) <= self.capacity:
+                break
+            if self.kept[0] <= chunk_x < self.kept[1] or self.ahead[0] <= chunk_x < self.ahead[1]:
+                continue
+            del self.chunks[chunk_x]
+            self.evictions += 1
+
+    def get_resident_bytes(self):
+        return sum(chunk.get_memory_size() for chunk in self.chunks.values())
 
     def get_chunk_range(self, left, right):
         begin = floor(left / TILE_SIZE / CHUNK_WIDTH)
@@ -156,10 +269,20 @@ class ChunkManager:
     def get_visible_chunk_range(self, camera_pos):
         return self.get_chunk_range(camera_pos[0] - SCREEN_WIDTH / 2, camera_pos[0] + SCREEN_WIDTH / 2)
 
+ENDLESS_LEVEL_PREFIX = "endless:"
+
+def open_level(name):
+    """Returns the chunk source of a level file, or of an endless level for names like endless:SEED"""
+    if name.startswith(ENDLESS_LEVEL_PREFIX):
+        return ProceduralChunkSource(int(name[len(ENDLESS_LEVEL_PREFIX):]), TILE_SIZE)
+
+    manifest = EntityManifest(get_manifest_filename(name), CHUNK_WIDTH * TILE_SIZE)
+    return MapChunkSource(load_map(name), manifest)
+
 class World:
-    def __init__(self, map_filename):
-        self.map = Map(map_filename)
-        self.chunk_manager = ChunkManager(self.map)
+    def __init__(self, level):
+        self.source = open_level(level)
+        self.chunk_manager = ChunkManager(self.source)
 
     def update(self, camera_pos):
         self.chunk_manager.update(camera_pos)
@@ -169,11 +292,12 @@ class World:
 
 
 class Collectible:
-    def __init__(self, pos, image):
+    def __init__(self, pos, image, size, entity_id=None):
         self.pos = pos
+        self.entity_id = entity_id # Index in the level's manifest
         self.collected = False
         self.image = image
-        self.rect = pygame.Rect(self.pos[0], self.pos[1], self.image.get_width(), self.image.get_height())
+        self.rect = pygame.Rect(self.pos[0], self.pos[1], size[0], size[1])
 
     def draw(self, surface, camera_pos):
         if not self.collected:
@@ -181,17 +305,25 @@ class Collectible:
             surface.blit(self.image, screen_pos)
 
 
+NORMAL_LEFT = (-1, 0)
+NORMAL_RIGHT = (1, 0)
+NORMAL_UP = (0, -1)
+NORMAL_DOWN = (0, 1)
+
 class MovableObject:
     def __init__(self, size, gravity):
         self.size = size
         self.gravity = gravity
 
         self.position = [0.0, 0.0]
+        self.prev_position = None # Position before the last update, for drawing between updates
         self.momentum = [0.0, 0.0]
         self.flip = False
         self.is_on_ground = False
 
     def update(self, world, dt):
+        self.prev_position = (self.position[0], self.position[1])
+
         # Friction
         self.momentum[0] *= 1.0 - FRICTION # TODO: better
         if abs(self.momentum[0]) < 2.0:
@@ -207,53 +339,74 @@ class MovableObject:
             else:
                 self.flip = True
 
-            self.position[0] += self.momentum[0] * dt
-            tile_rect = self.collide(world)
-            if tile_rect:
-                if self.momentum[0] > 0.0:
-                    self.position[0] = tile_rect.left - self.size[0]
-                else:
-                    self.position[0] = tile_rect.right
+            delta = self.momentum[0] * dt
+            (t, normal) = self.sweep(world, 0, delta)
+            if normal is None:
+                self.position[0] += delta
+            else:
+                # Tile edges and sizes are whole pixels, so round away the error of moving by delta * t
+                self.position[0] = round(self.position[0] + delta * t)
                 self.momentum[0] = 0.0
 
         # Y
         if self.momentum[1] != 0.0:
             self.is_on_ground = False
-            self.position[1] += self.momentum[1] * dt
-            tile_rect = self.collide(world)
-            if tile_rect:
-                if self.momentum[1] > 0.0:
-                    self.position[1] = tile_rect.top - self.size[1]
-                    self.is_on_ground = True
-                else:
-                    self.position[1] = tile_rect.bottom
+            delta = self.momentum[1] * dt
+            (t, normal) = self.sweep(world, 1, delta)
+            if normal is None:
+                self.position[1] += delta
+            else:
+                self.position[1] = round(self.position[1] + delta * t)
+                self.is_on_ground = normal is NORMAL_UP
                 self.momentum[1] = 0.0
 
-    def collide(self, world):
-        rect = self.get_rect()
-        chunk_range = world.chunk_manager.get_chunk_range(rect.left, rect.right)
-        for chunk_x in range(chunk_range[0], chunk_range[1]):
-            chunk = world.chunk_manager.get_chunk(chunk_x)
-            tile_x_range = chunk.get_tile_x_range(rect.left, rect.right)
-            tile_y_range = chunk.get_tile_y_range(rect.top, rect.bottom)
-            for tile_x in range(tile_x_range[0], tile_x_range[1]):
-                for tile_y in range(tile_y_range[0], tile_y_range[1]):
-                    if chunk.get_tile(tile_x, tile_y) == 0:
-                        continue
-
-                    tile_rect = chunk.get_tile_rect(tile_x, tile_y)
-                    collide = pygame.Rect.colliderect(rect, tile_rect)
-                    if collide:
-                        return tile_rect
+    def sweep(self, world, axis, delta):
+        """Sweeps the object along axis (0 for x, 1 for y) by delta and finds the first solid tile in the way.
+        Returns the contact time as a fraction of delta and the normal of the hit tile side, or (1.0, None) if the
+        whole move is free. A negative time means the object already overlapped that tile and has to move back"""
+        near = self.position[axis]
+        far = near + self.size[axis]
+
+        # Tiles overlapped on the other axis
+        cross_axis = 1 - axis
+        cross_begin = floor(self.position[cross_axis] / TILE_SIZE)
+        cross_end = ceil((self.position[cross_axis] + self.size[cross_axis]) / TILE_SIZE)
+
+        # Tile lines covered by the object and its move, starting from the trailing edge. For an object that doesn't
+        # overlap any tiles yet the lines behind the leading edge are empty, and one that does gets pushed out backwards
+        if delta > 0.0:
+            lines = range(floor(near / TILE_SIZE), ceil((far + delta) / TILE_SIZE))
+        else:
+            lines = range(ceil(far / TILE_SIZE) - 1, floor((near + delta) / TILE_SIZE) - 1, -1)
 
-        return None
+        chunk_manager = world.chunk_manager
+        for line in lines:
+            for cross in range(cross_begin, cross_end):
+                if axis == 0:
+                    tile = chunk_manager.get_tile(line, cross)
+                else:
+                    tile = chunk_manager.get_tile(cross, line)
+                if tile == NONE_TILE:
+                    continue
+
+                if delta > 0.0:
+                    return ((line * TILE_SIZE - far) / delta, NORMAL_LEFT if axis == 0 else NORMAL_UP)
+                else:
+                    return (((line + 1) * TILE_SIZE - near) / delta, NORMAL_RIGHT if axis == 0 else NORMAL_DOWN)
+
+        return (1.0, None)
 
-    def draw_with_image(self, surface, camera_pos, image):
-        rect = self.get_rect()
-        rect.topleft = world_to_screen(rect.topleft, camera_pos)
-        if self.flip:
-            image = pygame.transform.flip(image, True, False)
-        surface.blit(image, rect)
+    def draw_with_image(self, surface, camera_pos, image, alpha=1.0):
+        # The image has to be facing the right way already, see Animation.get_image
+        pos = self.get_draw_position(alpha)
+        screen_pos = world_to_screen((pos[0], ceil(pos[1])), camera_pos)
+        surface.blit(image, screen_pos)
+
+    def get_draw_position(self, alpha):
+        if self.prev_position is None:
+            return self.position
+        return (self.prev_position[0] + (self.position[0] - self.prev_position[0]) * alpha,
+                self.prev_position[1] + (self.position[1] - self.prev_position[1]) * alpha)
 
     def get_rect(self):
         # Ceil the position so as to avoid undetected collision on the ground
@@ -276,32 +429,44 @@ class Animation:
             self.speed = rules["speed"]
             self.loop = rules["loop"]
 
-            count = 0
-            for entry in os.scandir(filename):
-                if entry.path.split(".")[1] == "png":
-                    count += 1
+        # All frames share one atlas surface
+        paths = list_numbered_images(filename)
+        frames = [load_image_scaled_unshared(paths[i], IMAGE_SCALE // RENDER_DIVISOR) for i in range(len(paths))]
+        (self.atlas, self.images) = pack_atlas(frames)
 
-            self.images = [None] * count
-            for entry in os.scandir(filename):
-                base_name = os.path.basename(entry.path)
-                (name, ext) = base_name.split(".")
-                if ext == "png":
-                    self.images[int(name)] = load_image_scaled_default(entry.path)
+        # Mirrored once here instead of every time a sprite facing left is drawn.
+        # Flipping the atlas also reverses the order of the frames in it
+        self.flipped_atlas = pygame.transform.flip(self.atlas, True, False)
+        self.flipped_images = []
+        for image in self.images:
+            (x, _) = image.get_offset()
+            rect = pygame.Rect(self.atlas.get_width() - x - image.get_width(), 0, image.get_width(), image.get_height())
+            self.flipped_images.append(self.flipped_atlas.subsurface(rect))
 
     def get_size(self):
-        return [self.images[0].get_width(), self.images[0].get_height()]
+        """Size in world units"""
+        return [self.images[0].get_width() * RENDER_DIVISOR, self.images[0].get_height() * RENDER_DIVISOR]
+
+    def get_image(self, frame, flip=False):
+        """Returns the image shown at frame, mirrored if flip is set"""
+        return (self.flipped_images if flip else self.images)[self.frames[frame]]
+
+def load_animations(filename):
+    """Returns the animations in the subdirectories of filename, shared between every object using them"""
+    def load():
+        animations = {}
+        for entry in os.scandir(filename):
+            if entry.is_dir():
+                animations[entry.name] = Animation(entry.path)
+        return animations
+
+    return registry.get(("animations", filename, RENDER_DIVISOR), load)
 
 class AnimatableObject(MovableObject):
     def __init__(self, filename, gravity):
-        self.animations = {}
+        self.animations = load_animations(filename)
         size = [0, 0]
-        for entry in os.scandir(filename):
-            base_name = os.path.basename(entry.path)
-            if base_name == ".DS_Store":
-                continue
-
-            anim = Animation(entry.path)
-            self.animations[base_name] = anim
+        for anim in self.animations.values():
             size = anim.get_size()
 
         self.active_animation = None
@@ -313,14 +478,14 @@ class AnimatableObject(MovableObject):
         super().update(world, dt)
         self.time_since_anim_start += dt
 
-    def draw(self, surface, camera_pos):
+    def draw(self, surface, camera_pos, alpha=1.0):
         anim = self.active_animation
         frame = floor(self.time_since_anim_start / anim.speed)
         if anim.loop:
             frame %= len(anim.images) # Loop
         else:
             frame = min(frame, len(anim.images) - 1) # Cap
-        self.draw_with_image(surface, camera_pos, anim.images[anim.frames[frame]])
+        self.draw_with_image(surface, camera_pos, anim.get_image(frame, self.flip), alpha)
 
     def play_animation(self, name):
         self.active_animation = self.animations[name]
@@ -347,9 +512,9 @@ class Player(AnimatableObject):
         if self.invincibility_timer < 0.0:
             self.invincibility_timer = 0.0
 
-    def draw(self, surface, camera_pos):
+    def draw(self, surface, camera_pos, alpha=1.0):
         if self.invincibility_timer % (PLAYER_INVINCIBILITY_BLINK_PERIOD * 2) < PLAYER_INVINCIBILITY_BLINK_PERIOD:
-            super().draw(surface, camera_pos)
+            super().draw(surface, camera_pos, alpha)
 
     def take_damage(self):
         self.lives -= 1
@@ -359,11 +524,19 @@ BIRD_SPEED = 400
 BIRD_DIR_SWAP_TIME = 3.0
 
 class Bird(AnimatableObject):
+    # Description used by EnemyBatch
+    ANIMATIONS = "assets/super_mango/bird"
+    ANIMATION = "fly"
+    GRAVITY = 0.0
+    SPEED = BIRD_SPEED
+    DIR_SWAP_TIME = BIRD_DIR_SWAP_TIME
+    TURNS_AT_WALLS = False
+
     def __init__(self):
-        super().__init__("assets/super_mango/bird", 0.0)
+        super().__init__(self.ANIMATIONS, self.GRAVITY)
         self.timer = 0.0
         self.going_left = True
-        self.play_animation("fly")
+        self.play_animation(self.ANIMATION)
 
     def update(self, world, dt):
         if self.going_left:
@@ -380,10 +553,18 @@ class Bird(AnimatableObject):
 SPIDER_SPEED = 600
 
 class Spider(AnimatableObject):
+    # Description used by EnemyBatch
+    ANIMATIONS = "assets/super_mango/spider"
+    ANIMATION = "walk"
+    GRAVITY = GRAVITY
+    SPEED = SPIDER_SPEED
+    DIR_SWAP_TIME = None
+    TURNS_AT_WALLS = True
+
     def __init__(self):
-        super().__init__("assets/super_mango/spider", GRAVITY)
+        super().__init__(self.ANIMATIONS, self.GRAVITY)
         self.going_left = True
-        self.play_animation("walk")
+        self.play_animation(self.ANIMATION)
 
     def update(self, world, dt):
         if self.going_left:
@@ -396,24 +577,309 @@ class Spider(AnimatableObject):
         if self.momentum[0] == 0.0: # Bumped into a wall
             self.going_left = not self.going_left
 
+ENTITY_CELL_SIZE = TILE_SIZE * 4
+
+class EnemyGroup:
+    """Enemies of one kind, each one its own object. Used when NumPy isn't available"""
+    def __init__(self, kind):
+        self.kind = kind
+        self.enemies = []
+        self.entities = SpatialHash(ENTITY_CELL_SIZE)
+
+    def __len__(self):
+        return len(self.enemies)
+
+    def spawn(self, pos, entity_id=None):
+        enemy = self.kind()
+        enemy.position = list(pos)
+        enemy.entity_id = entity_id
+        self.enemies.append(enemy)
+        self.entities.insert(enemy, enemy.get_rect())
+
+    def retire_outside(self, left, right):
+        """Removes the enemies that are not between left and right, returns their entity ids"""
+        retired = [enemy for enemy in self.enemies if not left <= enemy.position[0] < right]
+        for enemy in retired:
+            self.enemies.remove(enemy)
+            self.entities.remove(enemy)
+        return [enemy.entity_id for enemy in retired]
+
+    def update(self, world, dt, active=None):
+        """Updates the enemies between the left and right of active, the others sleep"""
+        for enemy in self.enemies:
+            if active is None or active[0] <= enemy.position[0] < active[1]:
+                enemy.update(world, dt)
+                self.entities.update(enemy, enemy.get_rect())
+
+    def touches(self, rect):
+        return len(self.entities.query(rect)) != 0
+
+    def draw(self, surface, camera_pos, alpha=1.0, view=None):
+        """Draws the enemies whose rect is inside the view rect"""
+        for enemy in self.enemies:
+            if view is None or view.colliderect(enemy.get_rect()):
+                enemy.draw(surface, camera_pos, alpha)
+
+    def get_state(self):
+        """Positions and momenta as little-endian doubles, the same bytes as EnemyBatch.get_state"""
+        values = []
+        for enemy in self.enemies:
+            values += [enemy.position[0], enemy.position[1], enemy.momentum[0], enemy.momentum[1]]
+        return struct.pack(f"<{len(values)}d", *values)
+
+class EnemyBatch:
+    """Enemies of one kind stored as NumPy arrays, one row per enemy, and updated all at once.
+    Does the same as calling update on a Bird or Spider for each of them"""
+    ARRAYS = ["position", "prev_position", "momentum", "going_left", "flip", "timer", "time_since_anim_start", "entity_id"]
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.animation = load_animations(kind.ANIMATIONS)[kind.ANIMATION]
+        self.size = self.animation.get_size()
+
+        self.position = numpy.zeros((0, 2))
+        self.prev_position = numpy.zeros((0, 2))
+        self.momentum = numpy.zeros((0, 2))
+        self.going_left = numpy.zeros(0, bool)
+        self.flip = numpy.zeros(0, bool)
+        self.timer = numpy.zeros(0)
+        self.time_since_anim_start = numpy.zeros(0)
+        self.entity_id = numpy.zeros(0, int) # -1 for enemies that aren't from a manifest
+
+    def __len__(self):
+        return len(self.position)
+
+    def spawn(self, pos, entity_id=None):
+        new = {
+            "position": [pos],
+            "prev_position": [pos],
+            "momentum": [[0.0, 0.0]],
+            "going_left": [True],
+            "flip": [False],
+            "timer": [0.0],
+            "time_since_anim_start": [0.0],
+            "entity_id": [-1 if entity_id is None else entity_id],
+        }
+        for name in self.ARRAYS:
+            array = getattr(self, name)
+            setattr(self, name, numpy.concatenate([array, numpy.array(new[name], array.dtype)]))
+
+    def retire_outside(self, left, right):
+        """Removes the enemies that are not between left and right, returns their entity ids"""
+        inside = (self.position[:, 0] >= left) & (self.position[:, 0] < right)
+        retired = self.entity_id[~inside].tolist()
+        for name in self.ARRAYS:
+            setattr(self, name, getattr(self, name)[inside])
+        return [None if entity_id < 0 else entity_id for entity_id in retired]
+
+    def update(self, world, dt, active=None):
+        """Updates the enemies between the left and right of active, the others sleep"""
+        if len(self) == 0:
+            return
+
+        if active is not None:
+            awake = (self.position[:, 0] >= active[0]) & (self.position[:, 0] < active[1])
+            if not awake.all():
+                # Update a copy with just the awake enemies and write it back
+                batch = copy.copy(self)
+                for name in self.ARRAYS:
+                    setattr(batch, name, getattr(self, name)[awake])
+                batch.update(world, dt)
+                for name in self.ARRAYS:
+                    getattr(self, name)[awake] = getattr(batch, name)
+                return
+
+        kind = self.kind
+
+        self.prev_position[:] = self.position
+
+        # Walk or fly
+        self.momentum[:, 0] += numpy.where(self.going_left, -kind.SPEED * dt, kind.SPEED * dt)
+        if kind.DIR_SWAP_TIME is not None:
+            self.timer += dt
+            swap = self.timer > kind.DIR_SWAP_TIME
+            self.timer[swap] = 0.0
+            self.going_left ^= swap
+
+        # Friction
+        self.momentum[:, 0] *= 1.0 - FRICTION
+        self.momentum[numpy.abs(self.momentum[:, 0]) < 2.0, 0] = 0.0
+
+        # Gravity
+        self.momentum[:, 1] += kind.GRAVITY * dt
+
+        # X
+        moving = self.momentum[:, 0] != 0.0
+        self.flip[moving] = self.momentum[moving, 0] < 0.0
+        hit = self.sweep(world, 0, self.momentum[:, 0] * dt)
+        self.momentum[hit, 0] = 0.0
+
+        # Y
+        hit = self.sweep(world, 1, self.momentum[:, 1] * dt)
+        self.momentum[hit, 1] = 0.0
+
+        self.time_since_anim_start += dt
+
+        if kind.TURNS_AT_WALLS:
+            self.going_left ^= self.momentum[:, 0] == 0.0
+
+    def sweep(self, world, axis, delta):
+        """MovableObject.sweep for every enemy whose delta isn't 0. Moves them and returns a mask of the ones that hit a tile"""
+        hit = numpy.zeros(len(self), bool)
+        moving = numpy.nonzero(delta)[0]
+        if len(moving) == 0:
+            return hit
+        delta = delta[moving]
+
+        near = self.position[moving, axis]
+        far = near + self.size[axis]
+
+        # Tiles overlapped on the other axis
+        cross_near = self.position[moving, 1 - axis]
+        cross_begin = numpy.floor(cross_near / TILE_SIZE).astype(int)
+        cross_count = numpy.ceil((cross_near + self.size[1 - axis]) / TILE_SIZE).astype(int) - cross_begin
+
+        # Tile lines covered by each enemy and its move, from the trailing edge on
+        forward = delta > 0.0
+        first = numpy.where(forward, numpy.floor(near / TILE_SIZE), numpy.ceil(far / TILE_SIZE) - 1).astype(int)
+        end = numpy.where(forward, numpy.ceil((far + delta) / TILE_SIZE), numpy.floor((near + delta) / TILE_SIZE) - 1).astype(int)
+        direction = numpy.where(forward, 1, -1)
+        line_count = numpy.abs(end - first)
+
+        # Enemies x lines x crosses
+        line_steps = numpy.arange(line_count.max())
+        cross_steps = numpy.arange(cross_count.max())
+        lines = (first[:, None] + direction[:, None] * line_steps)[:, :, None]
+        crosses = (cross_begin[:, None] + cross_steps)[:, None, :]
+        if axis == 0:
+            tiles = self.get_tiles(world, lines, crosses)
+        else:
+            tiles = self.get_tiles(world, crosses, lines)
+        solid = tiles != NONE_TILE
+        solid &= (line_steps < line_count[:, None])[:, :, None]
+        solid &= (cross_steps < cross_count[:, None])[:, None, :]
+
+        solid_lines = solid.any(axis=2)
+        moving_hit = solid_lines.any(axis=1)
+        hit_line = first + direction * solid_lines.argmax(axis=1)
+        contact = numpy.where(forward, hit_line * TILE_SIZE - self.size[axis], (hit_line + 1) * TILE_SIZE)
+        self.position[moving, axis] = numpy.where(moving_hit, contact, near + delta)
+
+        hit[moving] = moving_hit
+        return hit
+
+    def get_tiles(self, world, tile_x, tile_y):
+        """Looks up the tiles at the broadcast tile coordinate arrays, reading every chunk involved once"""
+        (tile_x, tile_y) = numpy.broadcast_arrays(tile_x, tile_y)
+        chunk_x = tile_x // CHUNK_WIDTH
+        chunk_xs = numpy.unique(chunk_x)
+
+        chunks = []
+        for x in chunk_xs.tolist():
+            tiles = world.chunk_manager.get_chunk(x).tiles
+            chunks.append(numpy.frombuffer(tiles, numpy.uint16 if memoryview(tiles).itemsize == 2 else numpy.uint8))
+        grid = numpy.stack(chunks)
+
+        in_chunk = (tile_y >= 0) & (tile_y < CHUNK_HEIGHT)
+        index = (tile_x - chunk_x * CHUNK_WIDTH) * CHUNK_HEIGHT + numpy.clip(tile_y, 0, CHUNK_HEIGHT - 1)
+        return numpy.where(in_chunk, grid[numpy.searchsorted(chunk_xs, chunk_x), index], NONE_TILE)
+
+    def get_state(self):
+        """Positions and momenta as little-endian doubles, the same bytes as EnemyGroup.get_state"""
+        return numpy.concatenate([self.position, self.momentum], axis=1).astype("<f8").tobytes()
+
+    def get_rects(self):
+        """Same rects as MovableObject.get_rect, as left, top, right and bottom arrays"""
+        left = numpy.trunc(self.position[:, 0])
+        top = numpy.ceil(self.position[:, 1])
+        return (left, top, left + self.size[0], top + self.size[1])
+
+    def touches(self, rect):
+        (left, top, right, bottom) = self.get_rects()
+        return bool(numpy.any((left < rect.right) & (right > rect.left) & (top < rect.bottom) & (bottom > rect.top)))
+
+    def draw(self, surface, camera_pos, alpha=1.0, view=None):
+        """Draws the enemies whose rect is inside the view rect"""
+        anim = self.animation
+        position = self.prev_position + (self.position - self.prev_position) * alpha
+        frames = numpy.floor(self.time_since_anim_start / anim.speed).astype(int)
+        if anim.loop:
+            frames %= len(anim.images) # Loop
+        else:
+            frames = numpy.minimum(frames, len(anim.images) - 1) # Cap
+        flip = self.flip
+
+        if view is not None:
+            (left, top, right, bottom) = self.get_rects()
+            visible = (left < view.right) & (right > view.left) & (top < view.bottom) & (bottom > view.top)
+            (position, frames, flip) = (position[visible], frames[visible], flip[visible])
+
+        for ((x, y), frame, flip) in zip(position.tolist(), frames.tolist(), flip.tolist()):
+            surface.blit(anim.get_image(frame, flip), world_to_screen((x, ceil(y)), camera_pos))
+
+# Updating a batch has a fixed cost of about a quarter of a millisecond, which only pays off for bigger groups
+ENEMY_BATCH_MIN_COUNT = 64
+
+def make_enemy_group(kind, count):
+    """Returns an empty group for about count enemies of the given kind"""
+    if numpy is not None and count >= ENEMY_BATCH_MIN_COUNT:
+        return EnemyBatch(kind)
+    return EnemyGroup(kind)
+
 BACKGROUND_SCROLL = 0.2
 
+class ParallaxLayer:
+    """One background image, tiled into a strip at load time that covers the screen at any scroll offset, so that
+    drawing it is a single blit of part of the strip"""
+    def __init__(self, filename, scroll, opaque):
+        image = load_image_scaled_default(filename)
+        (width, height) = get_framebuffer_size()
+        self.width = image.get_width()
+        self.scroll = scroll
+
+        # One image more than fits on the screen horizontally, repeated vertically
+        self.strip = pygame.Surface(((width // self.width + 2) * self.width, height), 0 if opaque else pygame.SRCALPHA)
+        self.strip = self.strip.convert() if opaque else self.strip.convert_alpha()
+        for x in range(0, self.strip.get_width(), self.width):
+            for y in range(0, height, image.get_height()):
+                self.strip.blit(image, (x, y))
+
+    def get_offset(self, camera_pos):
+        return floor(camera_pos[0] * self.scroll / RENDER_DIVISOR) % self.width
+
+    def draw(self, surface, offset):
+        surface.blit(self.strip, (0, 0), (offset, 0, self.strip.get_width() - self.width, self.strip.get_height()))
+
 class Background:
-    def __init__(self, filename):
-        self.image = load_image_scaled_default(filename)
+    """Parallax layers drawn back to front, each scrolling at its own fraction of the camera speed.
+    With more than one layer, the layers are composed into one surface once the offsets stop changing, and that is
+    reused until they change again"""
+    def __init__(self, filename, scroll=BACKGROUND_SCROLL):
+        self.layers = [ParallaxLayer(filename, scroll, True)]
+        self.offsets = None # Of the last frame
+        self.composed = None
+        self.composed_offsets = None
+
+    def add_layer(self, filename, scroll):
+        self.layers.append(ParallaxLayer(filename, scroll, False))
+        self.offsets = self.composed_offsets = None
 
     def draw(self, surface, camera_pos):
-        pos_x = -camera_pos[0] * BACKGROUND_SCROLL
-        pos_x = pos_x % self.image.get_width()
-        self.draw_impl(surface, pos_x)
-        if pos_x > 0.0:
-            self.draw_impl(surface, pos_x - self.image.get_width())
-        else:
-            self.draw_impl(surface, pos_x + self.image.get_width())
-
-    def draw_impl(self, surface, pos_x):
-        surface.blit(self.image, (pos_x, 0))
-        surface.blit(self.image, (pos_x, self.image.get_height()))
+        offsets = [layer.get_offset(camera_pos) for layer in self.layers]
+        if len(self.layers) == 1 or offsets != self.offsets:
+            # While scrolling, drawing the layers straight away is cheaper than composing them first
+            self.offsets = offsets
+            for (layer, offset) in zip(self.layers, offsets):
+                layer.draw(surface, offset)
+            return
+
+        if offsets != self.composed_offsets:
+            if self.composed is None:
+                self.composed = pygame.Surface(get_framebuffer_size()).convert()
+            for (layer, offset) in zip(self.layers, offsets):
+                layer.draw(self.composed, offset)
+            self.composed_offsets = offsets
+        surface.blit(self.composed, (0, 0))
 
 CAMERA_DIFF_LIMIT = SCREEN_WIDTH / 15
 CAMERA_OFFSET = -SCREEN_WIDTH / 8
@@ -421,102 +887,114 @@ CAMERA_OFFSET = -SCREEN_WIDTH / 8
 EXIT_REASON_WIN = 0
 EXIT_REASON_LOOSE = 1
 EXIT_REASON_QUIT = 2
-exit_reason_win = [13000,1235,48,48 ]
-def play_game(screen, map_number, total_count_of_coins=0):
-    # Assets
-    font = pygame.font.Font("assets/Minecraft.ttf", 36)
-    heart_empty = load_image_scaled("assets/heart/empty.png", 4)
-    heart_full = load_image_scaled("assets/heart/full.png", 4)
 
-    # World
-    world = World(f"assets/maps/{map_number}.txt")
+SIMULATION_DT = 1.0 / 60.0
+ENTITY_ACTIVE_MARGIN = 1 # Chunks next to the visible range where entities are still updated
+MAX_FRAME_TIME = 0.25 # Longer frames are cut short instead of trying to catch up
 
-    # Background
-    background = Background("assets/super_mango/Forest_Background_0.png")
+class Inputs:
+    def __init__(self, left=False, right=False, jump=False):
+        self.left = left
+        self.right = right
+        self.jump = jump # Pressed since the last step
 
-    # Player
-    player = Player("assets/super_mango/player")
-    player.position = [0, CHUNK_HEIGHT * TILE_SIZE - SCREEN_HEIGHT / 2 - 100]
-    player.play_animation("idle")
-
-    # Camera
-    camera_pos = [player.position[0] + player.size[0] / 2 - CAMERA_OFFSET, CHUNK_HEIGHT * TILE_SIZE - SCREEN_HEIGHT / 2]
-
-    # Coins
-    coin_image= load_image_scaled_default("assets/super_mango/coin.png")
-    coins = []
-    coins.append(Collectible((96, 1200), coin_image))#1
-    coins.append(Collectible((140, 1200), coin_image))
-    coins.append(Collectible((170, 1200), coin_image))
-    coins.append(Collectible((600, 1200), coin_image))
-    coins.append(Collectible((759, 1150), coin_image))#5
-    coins.append(Collectible((1176, 1150), coin_image))
-    coins.append(Collectible((1309, 1150), coin_image))
-    coins.append(Collectible((1603, 1150), coin_image))
-    coins.append(Collectible((1668, 1150), coin_image))
-    coins.append(Collectible((1799, 1100), coin_image))#10
-    coins.append(Collectible((1957, 1050), coin_image))
-    coins.append(Collectible((2493, 1150), coin_image))
-    coins.append(Collectible((2678, 1150), coin_image))
-    coins.append(Collectible((3000, 1150), coin_image))
-    coins.append(Collectible((3500, 1080), coin_image))#15
-    coins.append(Collectible((4000, 1050), coin_image))
-    coins.append(Collectible((4500, 1050), coin_image))
-    coins.append(Collectible((5000, 1150), coin_image))
-    coins.append(Collectible((5500, 1050), coin_image))
-    coins.append(Collectible((6000, 970), coin_image))#20
-    coins.append(Collectible((6500, 1150), coin_image))
-    coins.append(Collectible((7000, 1150), coin_image))
-    coins.append(Collectible((7500, 1450), coin_image))
-    coins.append(Collectible((8000, 1150), coin_image))
-    coins.append(Collectible((8500, 1150), coin_image))#25
-    coins.append(Collectible((9000, 1150), coin_image))
-    coins.append(Collectible((9500, 1150), coin_image))
-    coins.append(Collectible((10000, 1150), coin_image))
-    coins.append(Collectible((10500, 1150), coin_image))
-    coins.append(Collectible((11500, 1150), coin_image))#30
-    coins.append(Collectible((12000, 1150), coin_image))
-
-    # Birds
-    birds = []
-    positions_b = [[550, 1150],[4350,1160],[4230,1170],[9800, 1350]]
-    for pos_b in positions_b:
-        bird = Bird()
-        bird.position = pos_b
-        birds.append(bird)
-
-    # Spiders
-    spiders = []
-    positions_s = [[500, 1000], [1100, 1400],[5050,1250],[4050,1200],[4400,1200],[11500,1100]]
-    for pos_s in positions_s:
-        spider = Spider()
-        spider.position = pos_s
-        spiders.append(spider)
-
-    # Star
-    star_image = load_image_scaled("assets/super_mango/Star_Yellow.png", 4)
-    star = Collectible((12500, 1150), star_image)
+class Simulation:
+    """The state of one level, advanced by fixed time steps with step(). Nothing in here draws or needs a display
+    except draw(), so a simulation can run headless and as fast as the CPU allows"""
+    def __init__(self, level):
+        # World, level is a level file or an endless level, see open_level
+        self.world = World(level)
 
-    # Clock
-    clock = pygame.time.Clock()
-    
-    # -------- Main Program Loop -----------
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                return EXIT_REASON_QUIT
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    player.try_jump(PLAYER_JUMP_HEIGHT)
-
-        dt = clock.tick(60) / 1000.0
-        dt = min(dt, 0.033) # Limit delta time to 33 milliseconds
-
-        keys = pygame.key.get_pressed()
-        if keys[pygame.K_a]:
+        # Player
+        self.player = Player("assets/super_mango/player")
+        self.player.position = [0, CHUNK_HEIGHT * TILE_SIZE - SCREEN_HEIGHT / 2 - 100]
+        self.player.play_animation("idle")
+
+        # Camera
+        self.camera_pos = [self.player.position[0] + self.player.size[0] / 2 - CAMERA_OFFSET, CHUNK_HEIGHT * TILE_SIZE - SCREEN_HEIGHT / 2]
+        self.prev_camera_pos = list(self.camera_pos)
+
+        # Entities are spawned as their chunks come into view and retired once they are far enough away, see
+        # spawn_chunk() and retire_chunk(). Collected coins are remembered so that they don't come back
+        self.source = self.world.source
+        self.coin_image = load_image_scaled_default("assets/super_mango/Coin.png")
+        self.coin_size = get_image_world_size("assets/super_mango/Coin.png", IMAGE_SCALE)
+        self.star_image = load_image_scaled_render("assets/super_mango/Star_Yellow.png", 4)
+        self.star_size = get_image_world_size("assets/super_mango/Star_Yellow.png", 4)
+        self.spawned = set() # Entity ids
+        self.collected = set()
+
+        # Coins the player can pick up
+        self.coins = {} # Entity id -> Collectible
+        self.entities = SpatialHash(ENTITY_CELL_SIZE)
+
+        # Enemies
+        self.birds = make_enemy_group(Bird, self.source.counts.get("bird", 0))
+        self.spiders = make_enemy_group(Spider, self.source.counts.get("spider", 0))
+        self.enemy_groups = {"bird": self.birds, "spider": self.spiders}
+        self.enemies = list(self.enemy_groups.values())
+
+        # Star
+        self.star = None
+
+        self.time = 0.0
+        self.ticks = 0
+
+        self.profiler = None # See profiler.py
+
+        # Spawn whatever is in view from the start
+        chunk_manager = self.world.chunk_manager
+        chunk_manager.enter_listeners.append(self.spawn_chunk)
+        chunk_manager.leave_listeners.append(self.retire_chunk)
+        self.world.update(self.camera_pos)
+
+    def spawn_chunk(self, chunk_x):
+        for (entity_id, type, pos) in self.source.get_entities(chunk_x):
+            if entity_id in self.spawned or entity_id in self.collected:
+                continue
+
+            self.spawned.add(entity_id)
+            if type == "coin":
+                coin = Collectible(pos, self.coin_image, self.coin_size, entity_id)
+                self.coins[entity_id] = coin
+                self.entities.insert(coin, coin.rect)
+            elif type == "star":
+                self.star = Collectible(pos, self.star_image, self.star_size, entity_id)
+            else:
+                self.enemy_groups[type].spawn(pos, entity_id)
+
+    def retire_chunk(self, chunk_x):
+        for (entity_id, type, pos) in self.source.get_entities(chunk_x):
+            if entity_id in self.coins:
+                self.entities.remove(self.coins.pop(entity_id))
+                self.spawned.discard(entity_id)
+            elif self.star is not None and self.star.entity_id == entity_id:
+                self.star = None
+                self.spawned.discard(entity_id)
+
+        # Enemies move, so they are retired by where they are now instead of where they started
+        (begin, end) = self.world.chunk_manager.kept
+        for enemies in self.enemies:
+            for entity_id in enemies.retire_outside(begin * CHUNK_WIDTH * TILE_SIZE, end * CHUNK_WIDTH * TILE_SIZE):
+                self.spawned.discard(entity_id)
+
+    def mark(self, name):
+        if self.profiler is not None:
+            self.profiler.mark(name)
+
+    def step(self, inputs, dt=SIMULATION_DT):
+        """Advances the simulation by dt, returns an exit reason once the level is over and None otherwise"""
+        player = self.player
+        self.time += dt
+        self.ticks += 1
+
+        if inputs.jump:
+            player.try_jump(PLAYER_JUMP_HEIGHT)
+        if inputs.left:
             player.move([-PLAYER_SPEED * dt, 0])
-        if keys[pygame.K_d]:
+        if inputs.right:
             player.move([PLAYER_SPEED * dt, 0])
+        self.mark("input")
 
         # Animations
 
@@ -531,70 +1009,236 @@ def play_game(screen, map_number, total_count_of_coins=0):
                 player.ensure_animation("fall")
             else:
                 player.ensure_animation("jump")
+        self.mark("animation")
 
         # Update
 
-        # Sprites
-        player.update(world, dt)
-        for bird in birds:
-            bird.update(world, dt)
-            if player.invincibility_timer == 0.0 and player.get_rect().colliderect(bird.get_rect()):
-                player.take_damage()
-        for spider in spiders:
-            spider.update(world, dt)
-            if player.invincibility_timer == 0.0 and player.get_rect().colliderect(spider.get_rect()):
-                player.take_damage()
-
-        if player.get_rect().colliderect(star.rect):
+        # Sprites, enemies far from the camera sleep
+        player.update(self.world, dt)
+        active = self.get_active_range()
+        for enemies in self.enemies:
+            enemies.update(self.world, dt, active)
+
+        player_rect = player.get_rect()
+        if player.invincibility_timer == 0.0 and any(enemies.touches(player_rect) for enemies in self.enemies):
+            player.take_damage()
+
+        touched = self.entities.query(player_rect)
+        self.mark("sprites")
+
+        if self.star is not None and player_rect.colliderect(self.star.rect):
             return EXIT_REASON_WIN
 
-        if player.lives == 0:
+        # Pits have no bottom, so falling out of the level loses it
+        if player.lives == 0 or player.position[1] >= CHUNK_HEIGHT * TILE_SIZE:
             return EXIT_REASON_LOOSE
 
         # Camera
+        self.prev_camera_pos[0] = self.camera_pos[0]
+        self.prev_camera_pos[1] = self.camera_pos[1]
         player_center_x = player.position[0] + player.size[0] / 2
         camera_follow_x = player_center_x - CAMERA_OFFSET
-        camera_diff_x = camera_follow_x - camera_pos[0]
+        camera_diff_x = camera_follow_x - self.camera_pos[0]
         if abs(camera_diff_x) > CAMERA_DIFF_LIMIT: # If player has moved too far away from the camera
-            camera_pos[0] = camera_follow_x + (-CAMERA_DIFF_LIMIT if camera_diff_x > 0.0 else CAMERA_DIFF_LIMIT)
+            self.camera_pos[0] = camera_follow_x + (-CAMERA_DIFF_LIMIT if camera_diff_x > 0.0 else CAMERA_DIFF_LIMIT)
+        self.mark("camera")
 
         # World
-        world.update(camera_pos)
+        self.world.update(self.camera_pos)
+        self.mark("world")
 
         # Coins
-        for coin in coins:
-            if not coin.collected and player.get_rect().colliderect(coin.rect):
-                coin.collected = True
-                player.collect_count += 1
-                # Append the count to the file
-                with open('src/count.txt', 'a') as file:
-                    file.write(f"{player.collect_count}\n")
+        for coin in touched:
+            coin.collected = True
+            self.entities.remove(coin)
+            del self.coins[coin.entity_id]
+            self.collected.add(coin.entity_id)
+            player.collect_count += 1
+        self.mark("coins")
 
-        # Background
-        background.draw(screen, camera_pos)
+        return None
 
-        # World
-        world.draw(screen, camera_pos)
+    def get_state_checksum(self):
+        """CRC-32 of everything that changes while playing, for checking that a replay is deterministic"""
+        player = self.player
+        state = struct.pack("<6dqqd", player.position[0], player.position[1], player.momentum[0], player.momentum[1],
+                            self.camera_pos[0], self.camera_pos[1], player.lives, player.collect_count, player.invincibility_timer)
+        for enemies in self.enemies:
+            state += enemies.get_state()
+        return zlib.crc32(state)
+
+    def get_active_range(self):
+        """Left and right of the part of the level where entities are awake"""
+        (begin, end) = self.world.chunk_manager.visible
+        return ((begin - ENTITY_ACTIVE_MARGIN) * CHUNK_WIDTH * TILE_SIZE, (end + ENTITY_ACTIVE_MARGIN) * CHUNK_WIDTH * TILE_SIZE)
+
+    def get_view_rect(self, camera_pos):
+        # A tile bigger on each side, since sprites are drawn between their last two positions
+        view = pygame.Rect(camera_pos[0] - SCREEN_WIDTH / 2, camera_pos[1] - SCREEN_HEIGHT / 2, SCREEN_WIDTH, SCREEN_HEIGHT)
+        return view.inflate(TILE_SIZE * 2, TILE_SIZE * 2)
+
+    def get_camera_pos(self, alpha=1.0):
+        """Camera position between the last two steps, alpha is how far into the current step the frame is"""
+        return (self.prev_camera_pos[0] + (self.camera_pos[0] - self.prev_camera_pos[0]) * alpha,
+                self.prev_camera_pos[1] + (self.camera_pos[1] - self.prev_camera_pos[1]) * alpha)
+
+    def draw(self, surface, alpha=1.0):
+        self.draw_world(surface, alpha)
+        self.draw_sprites(surface, alpha)
+
+    def draw_world(self, surface, alpha=1.0):
+        self.world.draw(surface, self.get_camera_pos(alpha))
+        self.mark("world draw")
+
+    def draw_sprites(self, surface, alpha=1.0):
+        camera_pos = self.get_camera_pos(alpha)
+        view = self.get_view_rect(camera_pos)
+        for enemies in self.enemies:
+            enemies.draw(surface, camera_pos, alpha, view)
+        for coin in self.entities.query(view):
+            coin.draw(surface, camera_pos)
+        if self.star is not None and view.colliderect(self.star.rect):
+            self.star.draw(surface, camera_pos)
+        self.player.draw(surface, camera_pos, alpha)
+        self.mark("sprite draw")
+
+def play_game(screen, map_number, total_count_of_coins=0, recorder=None, profiler=None, dirty_rects=False, stats=None, low_res=False,
+              level=None):
+    if dirty_rects and low_res:
+        raise ValueError("Dirty rect rendering doesn't work with low resolution rendering")
+
+    # With low_res the world is drawn at the size of the source art, see RENDER_DIVISOR
+    set_render_divisor(IMAGE_SCALE if low_res else 1)
+
+    # Assets
+    coin_text = HudText("Collected: {}", 36, (255, 255, 0))
+    heart_empty = load_image_scaled("assets/heart/empty.png", 4)
+    heart_full = load_image_scaled("assets/heart/full.png", 4)
 
-        # Sprites
-        for bird in birds:
-            bird.draw(screen, camera_pos)
-        for spider in spiders:
-            spider.draw(screen, camera_pos)
-        for coin in coins:
-            coin.draw(screen, camera_pos)
-        star.draw(screen, camera_pos)
-        player.draw(screen, camera_pos)
+    # Simulation
+    # level is a level name for open_level(), e.g. an endless one, instead of the map number
+    map_filename = level if level is not None else find_map(map_number)
+    simulation = Simulation(map_filename)
+    player = simulation.player
 
-        # HUD
+    # Recording, see replay.py
+    if recorder is not None:
+        recorder.begin(map_filename)
+
+    # Profiling, see profiler.py
+    simulation.profiler = profiler
+
+    # Background
+    background = Background("assets/super_mango/Forest_Background_0.png")
+
+    # Clock
+    clock = pygame.time.Clock()
+    accumulator = 0.0
+    jump = False
+
+    # Chunks ahead of the camera are loaded in the background, see prefetch.py
+    prefetcher = ChunkPrefetcher(simulation.world.chunk_manager)
+
+    # Rendering, only the parts of the screen that changed are redrawn with dirty_rects, see renderer.py
+    renderer = DirtyRenderer(screen) if dirty_rects else None
+    alpha = 1.0
+
+    # The low resolution framebuffer is scaled straight into the middle of the screen, the HUD stays sharp on top
+    framebuffer = None
+    if low_res:
+        framebuffer = pygame.Surface(get_framebuffer_size()).convert()
+        upscaled_size = (framebuffer.get_width() * RENDER_DIVISOR, framebuffer.get_height() * RENDER_DIVISOR)
+        upscaled = screen.subsurface(pygame.Rect((0, 0), upscaled_size).move((SCREEN_WIDTH - upscaled_size[0]) // 2, (SCREEN_HEIGHT - upscaled_size[1]) // 2))
+        screen.fill(BLACK)
+
+    def draw_scene(surface):
+        background.draw(surface, simulation.get_camera_pos(alpha))
+        simulation.mark("background")
+        simulation.draw_world(surface, alpha)
+
+    def draw_overlay(surface):
+        simulation.draw_sprites(surface, alpha)
+        draw_hud(surface)
+
+    def draw_hud(surface):
 
         # Coins
-        coin_text = font.render(f"Collected: {player.collect_count}", True, (255, 255, 0))
-        screen.blit(coin_text, (20, 20))
+        coin_text.draw(surface, (20, 20))
 
         # Lives
         for i in range(PLAYER_MAX_LIVES):
             image = heart_full if i < player.lives else heart_empty
-            screen.blit(image, (SCREEN_WIDTH - (image.get_width() + 20) * (PLAYER_MAX_LIVES - i), 20))
+            surface.blit(image, (SCREEN_WIDTH - (image.get_width() + 20) * (PLAYER_MAX_LIVES - i), 20))
+        simulation.mark("hud")
+
+        if profiler is not None:
+            profiler.draw(surface)
+            profiler.mark("profiler")
 
-        pygame.display.flip()
+    # -------- Main Program Loop -----------
+    try:
+        while True:
+            if profiler is not None:
+                profiler.begin_frame()
+
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    return EXIT_REASON_QUIT
+                elif event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_SPACE:
+                        jump = True
+                    elif event.key == pygame.K_F3 and profiler is not None:
+                        profiler.overlay = not profiler.overlay
+            simulation.mark("events")
+
+            accumulator += min(clock.tick(60) / 1000.0, MAX_FRAME_TIME)
+            simulation.mark("idle")
+
+            # Run as many fixed steps as fit into the time that has passed
+            keys = pygame.key.get_pressed()
+            while accumulator >= SIMULATION_DT:
+                collect_count = player.collect_count
+                inputs = Inputs(keys[pygame.K_a], keys[pygame.K_d], jump)
+                exit_reason = simulation.step(inputs)
+                jump = False
+                accumulator -= SIMULATION_DT
+
+                if recorder is not None:
+                    recorder.record(inputs, simulation)
+
+                if player.collect_count != collect_count and stats is not None:
+                    stats.collect(player.collect_count)
+
+                if exit_reason is not None:
+                    return exit_reason
+            simulation.mark("io")
+
+            # Draw the time left over as a fraction of the next step
+            alpha = accumulator / SIMULATION_DT
+
+            coin_text.set(player.collect_count)
+
+            if renderer is not None:
+                renderer.render(simulation.get_camera_pos(alpha), draw_scene, draw_overlay)
+            elif framebuffer is not None:
+                draw_scene(framebuffer)
+                simulation.draw_sprites(framebuffer, alpha)
+                pygame.transform.scale(framebuffer, upscaled_size, upscaled)
+                simulation.mark("upscale")
+                draw_hud(screen)
+                pygame.display.flip()
+            else:
+                draw_scene(screen)
+                draw_overlay(screen)
+                pygame.display.flip()
+            simulation.mark("flip")
+
+            # Load what's ahead in the time left before the next frame
+            prefetcher.update(simulation.camera_pos, player.momentum)
+            simulation.mark("prefetch")
+
+            if profiler is not None:
+                profiler.end_frame()
+    finally:
+        prefetcher.close()
+        set_render_divisor(1)
@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+
+NONE_TILE = 0
+
+CHUNK_WIDTH = 8
+CHUNK_HEIGHT = 32
+
+# Maps the ASCII digits of a level file to tile numbers
+DIGIT_TO_TILE = bytes.maketrans(b"0123456789", bytes(range(10)))
+
+def decode_row(row, filename, y):
+    if not row.isdigit():
+        raise ValueError(f"{filename}:{y + 1}: invalid tile in {row.decode(errors='replace')!r}")
+    return row.translate(DIGIT_TO_TILE)
+
+class Map:
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            rows = [line.strip() for line in file.read().splitlines()]
+
+        self.width = max((len(row) for row in rows), default=0)
+        self.height = len(rows)
+
+        # One byte per tile, stored column by column so that a run of columns is a single slice.
+        # Rows shorter than the widest one are padded with empty tiles
+        self.tiles = bytearray(self.width * self.height)
+        for y, row in enumerate(rows):
+            if row:
+                self.tiles[y : y + len(row) * self.height : self.height] = decode_row(row, filename, y)
+
+    def get_tile(self, x, y):
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return NONE_TILE
+
+        return self.tiles[x * self.height + y]
+
+    def get_columns(self, x, count, height):
+        """Returns the tiles of columns x to x + count as a column-major bytearray of count * height tiles"""
+        if x >= 0 and x + count <= self.width and height == self.height:
+            return self.tiles[x * height : (x + count) * height]
+
+        # Out of bounds tiles are empty
+        columns = bytearray(count * height)
+        rows = min(height, self.height)
+        for i in range(max(-x, 0), min(self.width - x, count)):
+            begin = (x + i) * self.height
+            columns[i * height : i * height + rows] = self.tiles[begin : begin + rows]
+
+        return columns
+
+WHITESPACE = b" \t\r\n"
+
+class StreamingMap:
+    """Same interface as Map, but memory-maps the level file and only decodes the columns that are asked for"""
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size > 0 else b""
+
+        # Index where each row starts and how long it is. Searching for the newlines is the only pass over the file
+        self.rows = []
+        begin = 0
+        while begin < size:
+            end = self.data.find(b"\n", begin)
+            if end == -1:
+                end = size
+            next_begin = end + 1
+
+            # Strip like Map does
+            while begin < end and self.data[begin] in WHITESPACE:
+                begin += 1
+            while end > begin and self.data[end - 1] in WHITESPACE:
+                end -= 1
+            self.rows.append((begin, end - begin))
+
+            begin = next_begin
+
+        self.width = max((length for (_, length) in self.rows), default=0)
+        self.height = len(self.rows)
+
+    def get_tile(self, x, y):
+        if y < 0 or y >= self.height:
+            return NONE_TILE
+
+        (begin, length) = self.rows[y]
+        if x < 0 or x >= length:
+            return NONE_TILE
+
+        return decode_row(self.data[begin + x : begin + x + 1], self.filename, y)[0]
+
+    def get_columns(self, x, count, height):
+        columns = bytearray(count * height)
+        for y in range(min(height, self.height)):
+            (begin, length) = self.rows[y]
+            first = max(x, 0)
+            last = min(x + count, length)
+            if first >= last:
+                continue
+
+            row = decode_row(self.data[begin + first : begin + last], self.filename, y)
+            columns[(first - x) * height + y : (last - x) * height : height] = row
+
+        return columns
+
+# Binary level format, all little-endian:
+#   header: magic, version, flags, width, height, chunk width (0 if not chunk aligned), reserved
+#   tiles: width * height tiles stored column by column, 1 or 2 bytes each
+# A chunk aligned level has its width padded to a multiple of the chunk width and its height padded to
+# CHUNK_HEIGHT, so every chunk is one contiguous section of the file that can be used without copying
+BINARY_MAP_MAGIC = b"PLVL"
+BINARY_MAP_VERSION = 1
+BINARY_MAP_HEADER = struct.Struct("<4sHHIIHH")
+
+BINARY_MAP_FLAG_WIDE_TILES = 1 << 0
+BINARY_MAP_FLAG_CHUNK_ALIGNED = 1 << 1
+
+class BinaryMap:
+    """Same interface as Map, reads a level written by write_binary_map straight from a memory-mapped file"""
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < BINARY_MAP_HEADER.size:
+            raise ValueError(f"{filename}: truncated level header")
+        (magic, version, self.flags, self.width, self.height, self.chunk_width, _) = BINARY_MAP_HEADER.unpack_from(self.data)
+        if magic != BINARY_MAP_MAGIC:
+            raise ValueError(f"{filename}: not a binary level")
+        if version != BINARY_MAP_VERSION:
+            raise ValueError(f"{filename}: unsupported level version {version}")
+
+        tile_format = "H" if self.flags & BINARY_MAP_FLAG_WIDE_TILES else "B"
+        end = BINARY_MAP_HEADER.size + self.width * self.height * struct.calcsize(tile_format)
+        if len(self.data) < end:
+            raise ValueError(f"{filename}: truncated tile data")
+        self.tile_format = tile_format
+        self.tiles = memoryview(self.data)[BINARY_MAP_HEADER.size : end].cast(tile_format)
+        if tile_format == "H" and sys.byteorder == "big":
+            # Wide tiles are little-endian in the file, so big-endian machines read a swapped copy
+            self.tiles = array("H", self.tiles.tobytes())
+            self.tiles.byteswap()
+
+    def get_tile(self, x, y):
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return NONE_TILE
+
+        return self.tiles[x * self.height + y]
+
+    def get_columns(self, x, count, height):
+        # Chunk aligned levels hit this every time, the chunk gets a read-only view into the file
+        if x >= 0 and x + count <= self.width and height == self.height:
+            return self.tiles[x * height : (x + count) * height]
+
+        columns = array(self.tile_format, bytes(count * height * self.tiles.itemsize))
+        rows = min(height, self.height)
+        for i in range(max(-x, 0), min(self.width - x, count)):
+            begin = (x + i) * self.height
+            columns[i * height : i * height + rows] = array(self.tile_format, self.tiles[begin : begin + rows])
+
+        return columns
+
+def write_binary_map(filename, map, chunk_aligned=False):
+    width = map.width
+    height = map.height
+    chunk_width = 0
+    if chunk_aligned:
+        width = -(-width // CHUNK_WIDTH) * CHUNK_WIDTH
+        height = max(height, CHUNK_HEIGHT)
+        chunk_width = CHUNK_WIDTH
+
+    tiles = map.get_columns(0, width, height)
+    flags = BINARY_MAP_FLAG_CHUNK_ALIGNED if chunk_aligned else 0
+    if max(tiles, default=NONE_TILE) > 0xff:
+        tiles = array("H", tiles)
+        if sys.byteorder == "big":
+            tiles.byteswap()
+        flags |= BINARY_MAP_FLAG_WIDE_TILES
+    else:
+        tiles = array("B", tiles)
+
+    with open(filename, "wb") as file:
+        file.write(BINARY_MAP_HEADER.pack(BINARY_MAP_MAGIC, BINARY_MAP_VERSION, flags, width, height, chunk_width, 0))
+        file.write(tiles.tobytes())
+
+# Levels at least this big are streamed instead of being decoded up front
+MAP_STREAMING_THRESHOLD = 1024 * 1024
+
+def load_map(filename):
+    with open(filename, "rb") as file:
+        magic = file.read(len(BINARY_MAP_MAGIC))
+    if magic == BINARY_MAP_MAGIC:
+        return BinaryMap(filename)
+
+    if os.path.getsize(filename) >= MAP_STREAMING_THRESHOLD:
+        return StreamingMap(filename)
+    return Map(filename)
+
+def find_map(name):
+    """Returns the path of a level in assets/maps, preferring a compiled level that is newer than its source"""
+    text_filename = f"assets/maps/{name}.txt"
+    binary_filename = f"assets/maps/{name}.bin"
+    if os.path.exists(binary_filename):
+        if not os.path.exists(text_filename) or os.path.getmtime(binary_filename) >= os.path.getmtime(text_filename):
+            return binary_filename
+    return text_filename
+
+# The entities of a level are listed in a JSON manifest next to it, e.g. assets/maps/1.json:
+#   {"entities": [{"type": "coin", "pos": [96, 1200]}, ...]}
+# with positions in pixels. Each entity is identified by its index in the list
+def get_manifest_filename(map_filename):
+    return os.path.splitext(map_filename)[0] + ".json"
+
+class EntityManifest:
+    """The entities of a level grouped by the chunk they start in, so that they can be spawned as chunks stream in"""
+    def __init__(self, filename, chunk_size):
+        self.chunks = {} # Chunk x -> [(id, type, pos)]
+        self.counts = {} # Type -> number of entities of that type
+
+        entities = []
+        if filename is not None and os.path.exists(filename):
+            with open(filename) as file:
+                entities = json.load(file)["entities"]
+
+        for (entity_id, entity) in enumerate(entities):
+            (x, y) = entity["pos"]
+            self.chunks.setdefault(int(x // chunk_size), []).append((entity_id, entity["type"], (x, y)))
+            self.counts[entity["type"]] = self.counts.get(entity["type"], 0) + 1
+
+    def get_entities(self, chunk_x):
+        return self.chunks.get(chunk_x, [])
+
+# A chunk source is where a ChunkManager gets its chunks from. It has:
+#   get_tiles(chunk_x): the tiles of a chunk, column-major like Map.get_columns. Called from worker threads too
+#   get_entities(chunk_x): the entities starting in a chunk, as (id, type, pos)
+#   chunk_count: the number of chunks, None if the level never ends
+#   counts: type -> number of entities of that type, for levels that know it up front
+class MapChunkSource:
+    """Chunks of a level file, with the entities of its manifest"""
+    def __init__(self, map, manifest):
+        self.map = map
+        self.manifest = manifest
+        self.chunk_count = -(-map.width // CHUNK_WIDTH)
+        self.counts = manifest.counts
+
+    def get_tiles(self, chunk_x):
+        return self.map.get_columns(chunk_x * CHUNK_WIDTH, CHUNK_WIDTH, CHUNK_HEIGHT)
+
+    def get_entities(self, chunk_x):
+        return self.manifest.get_entities(chunk_x)
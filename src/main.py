@@ -1,17 +1,43 @@
 import pygame
+import argparse
 
 from constants import *
 from menu import Menu
+from profiler import FrameProfiler
+from stats import StatsStore
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--record", metavar="FILE", help="record the inputs of the session for replay.py")
+    parser.add_argument("--profile", action="store_true", help="time every frame, F3 shows the timings while playing")
+    parser.add_argument("--trace", metavar="FILE", help="save the timings of every frame as .csv or .json, implies --profile")
+    parser.add_argument("--dirty-rects", action="store_true", help="only redraw the parts of the screen that changed")
+    parser.add_argument("--low-res", action="store_true", help="draw the world at the resolution of the art and upscale it")
+    parser.add_argument("--endless", type=int, metavar="SEED", help="play an endless level generated from SEED")
+    args = parser.parse_args()
+    if args.dirty_rects and args.low_res:
+        parser.error("--dirty-rects and --low-res can't be used together")
+
+    profiler = None
+    if args.profile or args.trace:
+        profiler = FrameProfiler(trace=args.trace is not None)
+        profiler.overlay = args.profile
+
     # Init
     pygame.init()
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Side-scrolling Platformer")
 
     # Menu
-    menu = Menu(screen, "assets/F_BG.png")
-    menu.main_menu()
+    stats = StatsStore()
+    menu = Menu(screen, "assets/F_BG.png", args.record, profiler, args.dirty_rects, stats, args.low_res, args.endless)
+    try:
+        menu.main_menu()
+    finally:
+        # The end screen quits with sys.exit(), the stats and the trace are saved either way
+        stats.close()
+        if args.trace:
+            profiler.save_trace(args.trace)
 
-    # Quit
-    pygame.quit()
+        # Quit
+        pygame.quit()
@@ -4,40 +4,60 @@ import sys
 from constants import *
 from game import *
 from button import Button
+from text import get_font, render_text
+from replay import Recorder
 
 
 class Menu:
-    def __init__(self, screen, BG_PATH):
+    def __init__(self, screen, BG_PATH, record_filename=None, profiler=None, dirty_rects=False, stats=None, low_res=False,
+                 endless_seed=None):
         self.BG = pygame.image.load(BG_PATH)
         self.screen = screen
+        self.record_filename = record_filename
+        self.profiler = profiler
+        self.dirty_rects = dirty_rects
+        self.stats = stats
+        self.low_res = low_res
+        self.endless_seed = endless_seed
 
     def get_font(self, size):
-        return pygame.font.Font("assets/Minecraft.ttf", size)
+        return get_font(size)
 
     def main_menu(self):
+        MENU_TEXT = render_text("MAIN MENU", 100, "WHITE")
+        MENU_RECT = MENU_TEXT.get_rect(center=(SCREEN_WIDTH // 2, 100))
+
+        BUTTON_IMAGE = pygame.image.load("assets/11zon_resized(1).png")
+        PLAY_BUTTON = Button(image=BUTTON_IMAGE, pos=(SCREEN_WIDTH // 2, 300),
+                             text_input="PLAY", font=self.get_font(75), base_color="GREEN", hovering_color="WHITE")
+        QUIT_BUTTON = Button(image=BUTTON_IMAGE, pos=(SCREEN_WIDTH // 2, 450),
+                             text_input="QUIT", font=self.get_font(75), base_color="GREEN", hovering_color="WHITE")
+
+        clock = pygame.time.Clock()
+        hovered = None
         while True:
-            self.screen.blit(self.BG, (0, 0))
+            clock.tick(60)
             MENU_MOUSE_POS = pygame.mouse.get_pos()
-            MENU_TEXT = self.get_font(100).render("MAIN MENU", True, "WHITE")
-            MENU_RECT = MENU_TEXT.get_rect(center=(SCREEN_WIDTH // 2, 100))
 
-            PLAY_BUTTON = Button(image=pygame.image.load("assets/11zon_resized(1).png"), pos=(SCREEN_WIDTH // 2, 300),
-                                 text_input="PLAY", font=self.get_font(75), base_color="GREEN", hovering_color="WHITE")
-            QUIT_BUTTON = Button(image=pygame.image.load("assets/11zon_resized(1).png"), pos=(SCREEN_WIDTH // 2, 450),
-                                 text_input="QUIT", font=self.get_font(75), base_color="GREEN", hovering_color="WHITE")
+            # Nothing changes on the menu unless the mouse moves onto or off a button
+            hover = [button.checkForInput(MENU_MOUSE_POS) for button in [PLAY_BUTTON, QUIT_BUTTON]]
+            if hover != hovered:
+                hovered = hover
+                self.screen.blit(self.BG, (0, 0))
+                self.screen.blit(MENU_TEXT, MENU_RECT)
 
-            self.screen.blit(MENU_TEXT, MENU_RECT)
+                for button in [PLAY_BUTTON, QUIT_BUTTON]:
+                    button.changeColor(MENU_MOUSE_POS)
+                    button.update(self.screen)
 
-            for button in [PLAY_BUTTON, QUIT_BUTTON]:
-                button.changeColor(MENU_MOUSE_POS)
-                button.update(self.screen)
+                pygame.display.update()
 
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     return
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     if PLAY_BUTTON.checkForInput(MENU_MOUSE_POS):
-                        exit_reason = play_game(self.screen, 1)
+                        exit_reason = self.play(1)
                         if exit_reason == EXIT_REASON_WIN:
                             self.show_end_screen(win=True)
                         elif exit_reason == EXIT_REASON_LOOSE:
@@ -48,43 +68,66 @@ class Menu:
                     if QUIT_BUTTON.checkForInput(MENU_MOUSE_POS):
                         return
 
-            pygame.display.update()
+    def play(self, map_number):
+        # Endless levels are generated from the seed, see procedural.py. Their stats go under map 0
+        level = None
+        if self.endless_seed is not None:
+            level = f"{ENDLESS_LEVEL_PREFIX}{self.endless_seed}"
+            map_number = 0
+
+        if self.stats is not None:
+            self.stats.begin_run(map_number)
+
+        if self.record_filename is None:
+            exit_reason = play_game(self.screen, map_number, profiler=self.profiler, dirty_rects=self.dirty_rects, stats=self.stats,
+                                    low_res=self.low_res, level=level)
+        else:
+            with Recorder(self.record_filename) as recorder:
+                exit_reason = play_game(self.screen, map_number, recorder=recorder, profiler=self.profiler,
+                                        dirty_rects=self.dirty_rects, stats=self.stats, low_res=self.low_res,
+                                        level=level)
+
+        # Written out in the background while the end screen shows
+        if self.stats is not None:
+            self.stats.end_run(exit_reason)
+
+        return exit_reason
 
     def show_end_screen(self, win):
+        clock = pygame.time.Clock()
+        drawn = False
         running = True
         while running:
+            clock.tick(60)
             for event in pygame.event.get():
                 if event.type == pygame.QUIT:
                     pygame.quit()
                     sys.exit()
                 if event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
                     running = False
+                if event.type == pygame.WINDOWEXPOSED:
+                    drawn = False
+
+            # The end screen never changes, so it is only drawn again when the window asks for it
+            if drawn:
+                continue
+            drawn = True
 
             self.screen.fill((0, 0, 0))
             msg = "You Won!" if win else "You Lost!"
             color = (0, 255, 0) if win else (255, 0, 0)
-            text = self.get_font(100).render(msg, True, color)
+            text = render_text(msg, 100, color)
             self.screen.blit(text, (200, 200))
             if win == True:
-                with open('src/count.txt', 'r') as file:
-                    lines = file.readlines()
-                    if lines:
-                        c_count = lines[-1].strip()
-                    else:
-                        c_count = '0'
-                info = self.get_font(36).render(f"GOOD JOB. TRY AGAIN.",True, (200, 200, 200))
-                info_c = self.get_font(36).render(f"Your total count of coins is: {c_count}", True, (200, 200, 200))
+                c_count = self.stats.coins if self.stats is not None else 0
+                info = render_text(f"GOOD JOB. TRY AGAIN.", 36, (200, 200, 200))
+                info_c = render_text(f"Your total count of coins is: {c_count}", 36, (200, 200, 200))
                 self.screen.blit(info, (150, 350))
                 self.screen.blit(info_c, (170, 400))
             elif win == False:
-                with open('src/count.txt', 'r') as file:
-                    lines = file.readlines()
-                    if lines:
-                        c_count = lines[-1].strip()
-                    else:
-                        c_count = '0'
-                info = self.get_font(36).render(f"NOT SO GOOD JOB. TRY AGAIN.", True, (200, 200, 200))
-                info_c = self.get_font(36).render(f"Your total count of coins is: {c_count}", True, (200, 200, 200))
+                c_count = self.stats.coins if self.stats is not None else 0
+                info = render_text(f"NOT SO GOOD JOB. TRY AGAIN.", 36, (200, 200, 200))
+                info_c = render_text(f"Your total count of coins is: {c_count}", 36, (200, 200, 200))
                 self.screen.blit(info, (150, 350))
                 self.screen.blit(info_c, (170, 400))
             pygame.display.flip()
\ No newline at end of file
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from game import *
+from replay import Recording, is_recording
+
+# Plays levels headless with scripted inputs, spread over all cores, e.g.
+#   python src/playtest.py assets/maps/1.txt --script assets/playtests/1_win.txt --expect win
+# Each script in assets/playtests says which result it expects.
+#
+# A script has one segment per line, "<actions> <seconds> [repeat]", where actions are left, right, jump or wait
+# joined with "+". Left and right are held for the whole segment, jump is pressed on its first step. "#" starts a
+# comment:
+#   right 1.5
+#   right+jump 0.4 10
+#   wait 1
+# Recordings made with main.py --record can be used as scripts too.
+
+SCRIPT_ACTIONS = {"left", "right", "jump", "wait"}
+
+def parse_script(filename):
+    segments = []
+    with open(filename) as file:
+        for (number, line) in enumerate(file, 1):
+            line = line.split("#")[0].strip()
+            if not line:
+                continue
+
+            parts = line.split()
+            if len(parts) not in (2, 3):
+                raise ValueError(f"{filename}:{number}: expected \"<actions> <seconds> [repeat]\"")
+            actions = set(parts[0].split("+"))
+            if not actions <= SCRIPT_ACTIONS:
+                raise ValueError(f"{filename}:{number}: unknown action {', '.join(sorted(actions - SCRIPT_ACTIONS))}")
+            repeat = int(parts[2]) if len(parts) == 3 else 1
+            segments += [(actions, float(parts[1]))] * repeat
+
+    return segments
+
+def script_inputs(segments):
+    """Yields the inputs for each step, nothing is pressed once the script is over"""
+    for (actions, seconds) in segments:
+        for tick in range(round(seconds / SIMULATION_DT)):
+            yield Inputs("left" in actions, "right" in actions, "jump" in actions and tick == 0)
+
+    while True:
+        yield Inputs()
+
+RESULT_NAMES = {EXIT_REASON_WIN: "win", EXIT_REASON_LOOSE: "loss", None: "timeout"}
+
+def play(job):
+    (map_filename, script_filename, timeout) = job
+    begin = time.perf_counter()
+
+    simulation = Simulation(map_filename)
+    if is_recording(script_filename):
+        inputs = iter(Recording(script_filename).get_inputs() + [Inputs()] * round(timeout / SIMULATION_DT))
+    else:
+        inputs = script_inputs(parse_script(script_filename))
+    exit_reason = None
+    for _ in range(round(timeout / SIMULATION_DT)):
+        exit_reason = simulation.step(next(inputs))
+        if exit_reason is not None:
+            break
+
+    return {
+        "map": map_filename,
+        "script": script_filename,
+        "result": RESULT_NAMES[exit_reason],
+        "coins": simulation.player.collect_count,
+        "lives": simulation.player.lives,
+        "simulated_time": round(simulation.time, 3),
+        "wall_time": round(time.perf_counter() - begin, 3),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play levels headless with scripted inputs")
+    parser.add_argument("maps", nargs="+", help="level files")
+    parser.add_argument("--script", action="append", required=True, help="input script, can be given several times")
+    parser.add_argument("--timeout", type=float, default=120.0, help="simulated seconds before a run counts as a timeout")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of processes")
+    parser.add_argument("--expect", choices=["win", "loss", "timeout"], help="exit with an error if any run ends differently")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    jobs = [(map_filename, script, args.timeout) for map_filename in args.maps for script in args.script]
+    with multiprocessing.Pool(min(args.workers, len(jobs))) as pool:
+        results = []
+        for result in pool.imap(play, jobs):
+            results.append(result)
+            if not args.json:
+                print(f"{result['map']} {result['script']}: {result['result']}, {result['coins']} coins, "
+                      f"{result['lives']} lives, {result['simulated_time']:.1f} s simulated in {result['wall_time']:.2f} s")
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=4)
+        print()
+
+    if args.expect is not None and any(result["result"] != args.expect for result in results):
+        sys.exit(1)
@@ -0,0 +1,64 @@
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import *
+
+PREFETCH_LOOKAHEAD_TIME = 1.0 # Seconds of camera motion to load ahead of
+PREFETCH_MARGIN = 1 # Extra chunks loaded on both sides of the predicted range
+PREFETCH_BAKE_BUDGET = 0.002 # Seconds per frame that may be spent baking prefetched chunks
+PREFETCH_WORKERS = 1
+
+class ChunkPrefetcher:
+    """Loads the chunks the camera is heading towards before they become visible. Tile data is read from the map on
+    worker threads, the finished chunks are handed to the ChunkManager and baked on the main thread, at most
+    budget seconds per frame, since surfaces must not be touched from other threads"""
+    def __init__(self, chunk_manager, workers=PREFETCH_WORKERS, budget=PREFETCH_BAKE_BUDGET):
+        self.chunk_manager = chunk_manager
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk-prefetch")
+        self.pending = {} # Chunk x -> future of its tiles
+        self.budget = budget
+
+        # Stats
+        self.prefetched = 0
+        self.baked = 0
+
+    def update(self, camera_pos, momentum):
+        chunk_manager = self.chunk_manager
+
+        # The camera follows the player, so the player's momentum tells where it will be soon
+        ahead_x = camera_pos[0] + momentum[0] * PREFETCH_LOOKAHEAD_TIME
+        (begin, end) = chunk_manager.get_chunk_range(min(camera_pos[0], ahead_x) - SCREEN_WIDTH / 2,
+                                                     max(camera_pos[0], ahead_x) + SCREEN_WIDTH / 2)
+        begin = begin - PREFETCH_MARGIN
+        end = end + PREFETCH_MARGIN
+        if chunk_manager.source.chunk_count is not None:
+            (begin, end) = (max(begin, 0), min(end, chunk_manager.source.chunk_count))
+        chunk_manager.ahead = (begin, end)
+
+        for chunk_x in range(begin, end):
+            if chunk_x not in chunk_manager.chunks and chunk_x not in self.pending:
+                self.pending[chunk_x] = self.executor.submit(chunk_manager.load_tiles, chunk_x)
+
+        # Hand over whatever the workers have finished
+        for (chunk_x, future) in list(self.pending.items()):
+            if future.done():
+                del self.pending[chunk_x]
+                if chunk_manager.add_chunk(chunk_x, future.result()):
+                    self.prefetched += 1
+
+        # Bake the nearest chunks first until the budget runs out
+        if chunk_manager.tileset is None:
+            return
+        center = chunk_manager.get_chunk_range(camera_pos[0], camera_pos[0])[0]
+        deadline = perf_counter() + self.budget
+        for chunk_x in sorted(range(begin, end), key=lambda chunk_x: abs(chunk_x - center)):
+            if perf_counter() >= deadline:
+                break
+            chunk = chunk_manager.chunks.get(chunk_x)
+            if chunk is not None and not chunk.baked:
+                chunk.bake(chunk_manager.tileset)
+                self.baked += 1
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pending = {}
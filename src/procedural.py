@@ -0,0 +1,134 @@
+import random
+import threading
+from collections import OrderedDict
+
+from level import *
+
+PROCEDURAL_CACHE_CAPACITY = 256 # Generated chunks kept around
+PROCEDURAL_SAFE_CHUNKS = 2 # Chunks on each side of the start that are flat and empty
+PROCEDURAL_MAX_ENTITIES = 64 # Per chunk, entity ids are made from the chunk x and this
+
+# Tiles, the same ones the level files use
+TILE_TOP_LEFT = 1
+TILE_TOP = 2
+TILE_TOP_RIGHT = 3
+TILE_LEFT = 4
+TILE_DIRT = 5
+TILE_RIGHT = 6
+
+# Rows of the ground surface. Neighbouring chunks are at most two rows apart, which the player can always jump
+GROUND_ROWS = (25, 26, 27)
+PLATFORM_HEIGHT = 4 # Rows above the ground
+
+class ProceduralChunkSource:
+    """Endless level generated chunk by chunk from a seed. A chunk only depends on the seed and its x, so chunks can
+    be generated in any order and on any thread and always come out the same. Generated chunks are memoized"""
+    def __init__(self, seed, tile_size):
+        self.seed = seed
+        self.tile_size = tile_size
+        self.chunk_count = None
+        self.counts = {} # Unknown up front
+
+        self.chunks = OrderedDict() # Chunk x -> (tiles, entities), least recently used first
+        self.lock = threading.Lock()
+
+        # Stats
+        self.generated = 0
+
+    def get_tiles(self, chunk_x):
+        # A copy, since chunks may change their tiles
+        return bytearray(self.get_chunk(chunk_x)[0])
+
+    def get_entities(self, chunk_x):
+        return self.get_chunk(chunk_x)[1]
+
+    def get_chunk(self, chunk_x):
+        with self.lock:
+            chunk = self.chunks.get(chunk_x)
+            if chunk is not None:
+                self.chunks.move_to_end(chunk_x)
+                return chunk
+
+        # Generated outside of the lock, two threads generating the same chunk get the same result anyway
+        chunk = self.generate(chunk_x)
+        with self.lock:
+            self.chunks[chunk_x] = chunk
+            self.generated += 1
+            if len(self.chunks) > PROCEDURAL_CACHE_CAPACITY:
+                self.chunks.popitem(last=False)
+        return chunk
+
+    def get_random(self, chunk_x, purpose):
+        # String seeds are hashed the same way in every process
+        return random.Random(f"{self.seed}:{chunk_x}:{purpose}")
+
+    def get_layout(self, chunk_x):
+        """Returns the ground row of a chunk and the range of columns of its pit, which is empty if it has none"""
+        if abs(chunk_x) < PROCEDURAL_SAFE_CHUNKS:
+            return (GROUND_ROWS[-1], range(0))
+
+        rng = self.get_random(chunk_x, "layout")
+        ground = rng.choice(GROUND_ROWS)
+        if rng.random() < 0.3:
+            width = rng.randint(2, 3)
+            begin = rng.randint(1, CHUNK_WIDTH - width - 1)
+            return (ground, range(begin, begin + width))
+        return (ground, range(0))
+
+    def get_ground(self, chunk_x, rel_x):
+        """Ground row of a column, rel_x may be just outside of the chunk. None over a pit"""
+        chunk_x += rel_x // CHUNK_WIDTH
+        rel_x %= CHUNK_WIDTH
+        (ground, pit) = self.get_layout(chunk_x)
+        return None if rel_x in pit else ground
+
+    def generate(self, chunk_x):
+        tiles = bytearray(CHUNK_WIDTH * CHUNK_HEIGHT)
+        entities = []
+        rng = self.get_random(chunk_x, "content")
+        safe = abs(chunk_x) < PROCEDURAL_SAFE_CHUNKS
+
+        # Ground, with edge tiles where a column stands higher than its neighbour
+        for x in range(CHUNK_WIDTH):
+            ground = self.get_ground(chunk_x, x)
+            if ground is None:
+                continue
+            left = self.get_ground(chunk_x, x - 1)
+            right = self.get_ground(chunk_x, x + 1)
+            open_left = left is None or left > ground
+            open_right = right is None or right > ground
+            for y in range(ground, CHUNK_HEIGHT):
+                if y == ground:
+                    tile = TILE_TOP_LEFT if open_left else TILE_TOP_RIGHT if open_right else TILE_TOP
+                else:
+                    tile = TILE_LEFT if open_left and y < (left or CHUNK_HEIGHT) else TILE_RIGHT if open_right and y < (right or CHUNK_HEIGHT) else TILE_DIRT
+                tiles[x * CHUNK_HEIGHT + y] = tile
+
+        (ground, pit) = self.get_layout(chunk_x)
+        if not safe and rng.random() < 0.4:
+            # A platform, with coins on top of it
+            width = rng.randint(3, 4)
+            begin = rng.randint(0, CHUNK_WIDTH - width)
+            y = ground - PLATFORM_HEIGHT
+            for x in range(begin, begin + width):
+                tiles[x * CHUNK_HEIGHT + y] = TILE_TOP_LEFT if x == begin else TILE_TOP_RIGHT if x == begin + width - 1 else TILE_TOP
+                if x != begin and x != begin + width - 1:
+                    entities.append(("coin", (x, y - 1)))
+        else:
+            # Coins over the ground, at most one per column
+            columns = [x for x in range(CHUNK_WIDTH) if x not in pit]
+            for column in rng.sample(columns, rng.randint(0, 3)):
+                entities.append(("coin", (column, ground - 2)))
+
+        if not safe:
+            if rng.random() < 0.3:
+                entities.append(("spider", (rng.randrange(CHUNK_WIDTH), ground - 2)))
+            if rng.random() < 0.15:
+                entities.append(("bird", (rng.randrange(CHUNK_WIDTH), ground - 6)))
+
+        # Tile coordinates to positions and ids unique over every chunk, negative chunks included
+        index = chunk_x * 2 if chunk_x >= 0 else -chunk_x * 2 - 1
+        entities = [(index * PROCEDURAL_MAX_ENTITIES + i, type, ((chunk_x * CHUNK_WIDTH + x) * self.tile_size, y * self.tile_size))
+                    for (i, (type, (x, y))) in enumerate(entities)]
+
+        return (bytes(tiles), entities)
@@ -0,0 +1,92 @@
+import csv
+import json
+import pygame
+from time import perf_counter
+from collections import deque
+
+PROFILER_WINDOW = 300 # Frames the percentiles are computed over
+PROFILER_OVERLAY_REFRESH = 15 # Frames between overlay updates, so that it stays readable and cheap
+PROFILER_PERCENTILES = (50, 95, 99)
+
+class FrameProfiler:
+    """Times the phases of each frame. Call begin_frame(), then mark(name) at the end of every phase and end_frame()
+    once the frame is done. Keeps a rolling window of every phase for percentiles and optionally a full trace"""
+    def __init__(self, window=PROFILER_WINDOW, trace=False):
+        self.samples = {} # Phase name -> seconds of the last frames, in the order the phases first ran
+        self.window = window
+        self.frame = {}
+        self.frame_begin = 0.0
+        self.last_mark = 0.0
+        self.frame_count = 0
+        self.trace = [] if trace else None
+
+        self.overlay = False
+        self.overlay_surface = None
+        self.overlay_frame = -1
+        self.font = None
+
+    def begin_frame(self):
+        self.frame = {}
+        self.frame_begin = self.last_mark = perf_counter()
+
+    def mark(self, name):
+        """Ends the phase called name, which began at the previous mark"""
+        now = perf_counter()
+        self.frame[name] = self.frame.get(name, 0.0) + now - self.last_mark
+        self.last_mark = now
+
+    def end_frame(self):
+        self.frame["frame"] = perf_counter() - self.frame_begin
+        for (name, seconds) in self.frame.items():
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(seconds)
+
+        if self.trace is not None:
+            self.trace.append(self.frame)
+        self.frame_count += 1
+
+    def get_percentiles(self, name):
+        samples = sorted(self.samples[name])
+        return [samples[min(len(samples) - 1, len(samples) * percentile // 100)] for percentile in PROFILER_PERCENTILES]
+
+    def save_trace(self, filename):
+        """Writes the per-frame timings in milliseconds, as CSV if filename ends with .csv and as JSON otherwise"""
+        names = list(self.samples)
+        rows = [{name: round(frame.get(name, 0.0) * 1000.0, 4) for name in names} for frame in self.trace]
+        with open(filename, "w", newline="") as file:
+            if filename.endswith(".csv"):
+                writer = csv.DictWriter(file, ["index"] + names)
+                writer.writeheader()
+                for (index, row) in enumerate(rows):
+                    writer.writerow(dict(row, index=index))
+            else:
+                json.dump(rows, file)
+
+    def draw(self, surface):
+        if not self.overlay or not self.samples:
+            return
+
+        if self.font is None:
+            self.font = pygame.font.SysFont("monospace", 14)
+
+        # Drawn more than once per frame by the DirtyRenderer, but only rebuilt once
+        if self.overlay_surface is None or (self.frame_count % PROFILER_OVERLAY_REFRESH == 0 and self.overlay_frame != self.frame_count):
+            self.overlay_frame = self.frame_count
+            header = "ms".ljust(12) + "".join(f"p{percentile}".rjust(8) for percentile in PROFILER_PERCENTILES)
+            lines = [header]
+            for name in self.samples:
+                lines.append(name.ljust(12) + "".join(f"{seconds * 1000.0:8.2f}" for seconds in self.get_percentiles(name)))
+
+            images = [self.font.render(line, True, (255, 255, 255)) for line in lines]
+            width = max(image.get_width() for image in images)
+            height = sum(image.get_height() for image in images)
+            self.overlay_surface = pygame.Surface((width + 10, height + 10))
+            self.overlay_surface.fill((0, 0, 0))
+            self.overlay_surface.set_alpha(180)
+            y = 5
+            for image in images:
+                self.overlay_surface.blit(image, (5, y))
+                y += image.get_height()
+
+        surface.blit(self.overlay_surface, (10, surface.get_height() - self.overlay_surface.get_height() - 10))
@@ -0,0 +1,86 @@
+import pygame
+
+DIRTY_RECT_MERGE_LIMIT = 8 # More dirty rects than this are merged into one
+DIRTY_AREA_FULL_REDRAW = 0.5 # Fraction of the screen above which a full redraw is cheaper
+
+class MeasuringSurface:
+    """Stands in for the screen and records what would be blitted where, without drawing anything"""
+    def __init__(self, surface):
+        self.surface = surface
+        self.blits = [] # (rect, source)
+
+    def blit(self, source, dest, area=None, special_flags=0):
+        size = source.get_size() if area is None else pygame.Rect(area).size
+        rect = pygame.Rect(dest[0], dest[1], size[0], size[1]).clip(self.surface.get_rect())
+        self.blits.append((rect, source))
+        return rect
+
+    def __getattr__(self, name):
+        return getattr(self.surface, name)
+
+class DirtyRenderer:
+    """Only redraws the parts of the screen that changed since the last frame and only pushes those to the display.
+    The frame is split in two: the scene, which only changes when the camera moves, and the overlay (sprites and
+    HUD), which is tracked by what it blits. When the camera moves, everything is redrawn"""
+    def __init__(self, surface):
+        self.surface = surface
+        self.camera_pos = None
+        self.blits = []
+
+        # Stats
+        self.full_redraws = 0
+        self.updated_area = 0
+
+    def invalidate(self):
+        self.camera_pos = None
+
+    def render(self, camera_pos, draw_scene, draw_overlay):
+        """draw_scene(surface) and draw_overlay(surface) draw the two parts of the frame, the overlay on top"""
+        measure = MeasuringSurface(self.surface)
+        draw_overlay(measure)
+        blits = measure.blits
+
+        if camera_pos != self.camera_pos:
+            rects = None
+        else:
+            # Whatever was drawn last frame but not this one has to be erased and whatever is new has to be drawn
+            old = {(tuple(rect), id(source)) for (rect, source) in self.blits}
+            new = {(tuple(rect), id(source)) for (rect, source) in blits}
+            rects = [pygame.Rect(rect) for (rect, _) in old ^ new if rect[2] > 0 and rect[3] > 0]
+            rects = self.merge(rects)
+
+        self.camera_pos = camera_pos
+        self.blits = blits # Keeps the sources alive, so that their ids can't be reused
+
+        if rects is None:
+            draw_scene(self.surface)
+            draw_overlay(self.surface)
+            pygame.display.flip()
+            self.full_redraws += 1
+            self.updated_area = self.surface.get_width() * self.surface.get_height()
+            return
+
+        for rect in rects:
+            self.surface.set_clip(rect)
+            draw_scene(self.surface)
+            draw_overlay(self.surface)
+        self.surface.set_clip(None)
+        pygame.display.update(rects)
+        self.updated_area = sum(rect.width * rect.height for rect in rects)
+
+    def merge(self, rects):
+        """Joins overlapping rects, returns None if a full redraw would be cheaper"""
+        merged = []
+        for rect in rects:
+            for other in [other for other in merged if other.colliderect(rect)]:
+                merged.remove(other)
+                rect = rect.union(other)
+            merged.append(rect)
+
+        if len(merged) > DIRTY_RECT_MERGE_LIMIT:
+            merged = [merged[0].unionall(merged[1:])]
+
+        screen_area = self.surface.get_width() * self.surface.get_height()
+        if sum(rect.width * rect.height for rect in merged) > screen_area * DIRTY_AREA_FULL_REDRAW:
+            return None
+        return merged
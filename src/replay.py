@@ -0,0 +1,142 @@
+import os
+import sys
+import time
+import struct
+import argparse
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+from game import *
+
+# Recordings store the inputs of every simulation step, so that a session can be played again exactly.
+# Format, all little-endian:
+#   header: magic, version, flags, time step, length of the map filename, map filename (UTF-8)
+#   one record per step: input bits, followed by the CRC-32 of the simulation state if checksums are on
+RECORDING_MAGIC = b"PREC"
+RECORDING_VERSION = 1
+RECORDING_HEADER = struct.Struct("<4sHHdH")
+RECORDING_FLAG_CHECKSUMS = 1 << 0
+
+INPUT_LEFT = 1 << 0
+INPUT_RIGHT = 1 << 1
+INPUT_JUMP = 1 << 2
+
+def encode_inputs(inputs):
+    return (INPUT_LEFT if inputs.left else 0) | (INPUT_RIGHT if inputs.right else 0) | (INPUT_JUMP if inputs.jump else 0)
+
+def decode_inputs(bits):
+    return Inputs(bits & INPUT_LEFT != 0, bits & INPUT_RIGHT != 0, bits & INPUT_JUMP != 0)
+
+class Recorder:
+    def __init__(self, filename, checksums=True):
+        self.file = open(filename, "wb")
+        self.checksums = checksums
+        self.step = struct.Struct("<BI" if checksums else "<B")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def begin(self, map_filename, dt=SIMULATION_DT):
+        map_filename = map_filename.encode()
+        flags = RECORDING_FLAG_CHECKSUMS if self.checksums else 0
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, flags, dt, len(map_filename)))
+        self.file.write(map_filename)
+
+    def record(self, inputs, simulation):
+        """Call after every step with the inputs it was given"""
+        if self.checksums:
+            self.file.write(self.step.pack(encode_inputs(inputs), simulation.get_state_checksum()))
+        else:
+            self.file.write(self.step.pack(encode_inputs(inputs)))
+
+    def close(self):
+        self.file.close()
+
+class Recording:
+    def __init__(self, filename):
+        with open(filename, "rb") as file:
+            data = file.read()
+
+        if len(data) < RECORDING_HEADER.size:
+            raise ValueError(f"{filename}: truncated recording header")
+        (magic, version, flags, self.dt, map_filename_length) = RECORDING_HEADER.unpack_from(data)
+        if magic != RECORDING_MAGIC:
+            raise ValueError(f"{filename}: not a recording")
+        if version != RECORDING_VERSION:
+            raise ValueError(f"{filename}: unsupported recording version {version}")
+
+        begin = RECORDING_HEADER.size + map_filename_length
+        self.map_filename = data[RECORDING_HEADER.size : begin].decode()
+
+        # (input bits, checksum or None) per step. A recording cut short by a crash ends with a partial step
+        step = struct.Struct("<BI" if flags & RECORDING_FLAG_CHECKSUMS else "<B")
+        count = (len(data) - begin) // step.size
+        records = step.iter_unpack(data[begin : begin + count * step.size])
+        if flags & RECORDING_FLAG_CHECKSUMS:
+            self.steps = list(records)
+        else:
+            self.steps = [(bits, None) for (bits,) in records]
+
+    def get_inputs(self):
+        return [decode_inputs(bits) for (bits, _) in self.steps]
+
+def is_recording(filename):
+    with open(filename, "rb") as file:
+        return file.read(len(RECORDING_MAGIC)) == RECORDING_MAGIC
+
+class ReplayMismatch(Exception):
+    pass
+
+def replay(recording, realtime=False, verify=True, screen=None):
+    """Plays a recording again, as fast as possible unless realtime is set. Draws to screen if one is given.
+    Raises ReplayMismatch as soon as the state stops matching the recorded checksums"""
+    simulation = Simulation(recording.map_filename)
+    clock = pygame.time.Clock()
+    exit_reason = None
+    for (tick, (bits, checksum)) in enumerate(recording.steps):
+        exit_reason = simulation.step(decode_inputs(bits), recording.dt)
+        if verify and checksum is not None and simulation.get_state_checksum() != checksum:
+            raise ReplayMismatch(f"state differs from the recording at step {tick}")
+
+        if screen is not None:
+            screen.fill(BLACK)
+            simulation.draw(screen)
+            pygame.display.flip()
+            pygame.event.pump()
+        if realtime:
+            clock.tick(1.0 / recording.dt)
+
+        if exit_reason is not None:
+            break
+
+    return (simulation, exit_reason)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play a recorded session again")
+    parser.add_argument("recording")
+    parser.add_argument("--realtime", action="store_true", help="run at the recorded speed instead of as fast as possible")
+    parser.add_argument("--render", action="store_true", help="show the replay in a window, implies --realtime")
+    parser.add_argument("--no-verify", action="store_true", help="don't compare the state with the recorded checksums")
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+
+    screen = None
+    if args.render:
+        pygame.init()
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("Replay")
+
+    begin = time.perf_counter()
+    try:
+        (simulation, exit_reason) = replay(recording, args.realtime or args.render, not args.no_verify, screen)
+    except ReplayMismatch as e:
+        print(f"{args.recording}: {e}")
+        sys.exit(1)
+
+    result = {EXIT_REASON_WIN: "win", EXIT_REASON_LOOSE: "loss", None: "unfinished"}[exit_reason]
+    print(f"{args.recording}: {result} after {simulation.ticks} of {len(recording.steps)} steps, "
+          f"{simulation.player.collect_count} coins, {simulation.time:.1f} s simulated in {time.perf_counter() - begin:.2f} s")
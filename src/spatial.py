@@ -0,0 +1,59 @@
+from math import floor
+
+class SpatialHash:
+    """Broad phase for entity collisions. Space is split into square cells and every object is registered in the
+    cells its rect touches, so a query only has to look at the objects near the queried rect"""
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {} # (cell x, cell y) -> set of objects
+        self.objects = {} # object -> (rect, cell range)
+
+    def get_cell_range(self, rect):
+        return (floor(rect.left / self.cell_size), floor(rect.top / self.cell_size),
+                floor((rect.right - 1) / self.cell_size) + 1, floor((rect.bottom - 1) / self.cell_size) + 1)
+
+    def insert(self, obj, rect):
+        cell_range = self.get_cell_range(rect)
+        self.objects[obj] = (rect, cell_range)
+        for cell_x in range(cell_range[0], cell_range[2]):
+            for cell_y in range(cell_range[1], cell_range[3]):
+                self.cells.setdefault((cell_x, cell_y), set()).add(obj)
+
+    def remove(self, obj):
+        (_, cell_range) = self.objects.pop(obj)
+        for cell_x in range(cell_range[0], cell_range[2]):
+            for cell_y in range(cell_range[1], cell_range[3]):
+                cell = self.cells[(cell_x, cell_y)]
+                cell.discard(obj)
+                if not cell:
+                    del self.cells[(cell_x, cell_y)]
+
+    def update(self, obj, rect):
+        (_, cell_range) = self.objects[obj]
+        if self.get_cell_range(rect) == cell_range:
+            # Still in the same cells, which is the usual case
+            self.objects[obj] = (rect, cell_range)
+        else:
+            self.remove(obj)
+            self.insert(obj, rect)
+
+    def query(self, rect):
+        """Returns the objects whose rect collides with rect"""
+        found = []
+        seen = set()
+        cell_range = self.get_cell_range(rect)
+        for cell_x in range(cell_range[0], cell_range[2]):
+            for cell_y in range(cell_range[1], cell_range[3]):
+                for obj in self.cells.get((cell_x, cell_y), ()):
+                    if obj not in seen:
+                        seen.add(obj)
+                        if rect.colliderect(self.objects[obj][0]):
+                            found.append(obj)
+
+        return found
+
+    def __contains__(self, obj):
+        return obj in self.objects
+
+    def __len__(self):
+        return len(self.objects)
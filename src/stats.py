@@ -0,0 +1,125 @@
+import os
+import time
+import struct
+import threading
+
+# Run history, all little-endian:
+#   header: magic, version, record count, runs, wins, total coins, best coins in a run
+#   records: time, event, map number, coins collected in the run so far
+# The header is rewritten in place after every flush, so the totals never require reading the records back
+STATS_FILENAME = os.environ.get("PLATFORMER_STATS_FILE", "stats.bin")
+STATS_MAGIC = b"PSTA"
+STATS_VERSION = 1
+STATS_HEADER = struct.Struct("<4sHIIIII")
+STATS_RECORD = struct.Struct("<dBHH")
+STATS_FLUSH_THRESHOLD = 64 # Buffered records that trigger a flush before the run ends
+
+EVENT_COIN = 0
+EVENT_RUN_END = 1 # Followed by the exit reason, so 1 is a win, 2 a loss and 3 a quit
+
+class StatsStore:
+    """Keeps coin counts and run totals in memory. Records are buffered and appended to the history file on a
+    background thread, so the game loop never waits for the disk"""
+    def __init__(self, filename=STATS_FILENAME):
+        self.filename = filename
+        self.record_count = 0
+        self.runs = 0
+        self.wins = 0
+        self.total_coins = 0
+        self.best_coins = 0
+
+        # Current run
+        self.map_number = 0
+        self.coins = 0
+
+        self.pending = []
+        self.lock = threading.Lock() # Guards pending, the file is only ever written by one thread at a time
+        self.thread = None
+
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, "rb") as file:
+                header = file.read(STATS_HEADER.size)
+            (magic, version, *totals) = STATS_HEADER.unpack(header)
+        except (OSError, struct.error):
+            return
+
+        if magic == STATS_MAGIC and version == STATS_VERSION:
+            (self.record_count, self.runs, self.wins, self.total_coins, self.best_coins) = totals
+
+    def begin_run(self, map_number):
+        self.map_number = map_number
+        self.coins = 0
+
+    def collect(self, coins):
+        """Called with the coins collected in the run so far every time a coin is collected"""
+        self.total_coins += coins - self.coins
+        self.coins = coins
+        self.record(EVENT_COIN)
+
+    def end_run(self, exit_reason):
+        self.runs += 1
+        if exit_reason == 0: # EXIT_REASON_WIN
+            self.wins += 1
+        self.best_coins = max(self.best_coins, self.coins)
+        self.record(EVENT_RUN_END + exit_reason)
+        self.flush()
+
+    def record(self, event):
+        with self.lock:
+            self.pending.append(STATS_RECORD.pack(time.time(), event, self.map_number, self.coins))
+            count = len(self.pending)
+        if count >= STATS_FLUSH_THRESHOLD:
+            self.flush()
+
+    def flush(self, wait=False):
+        """Writes the buffered records on a background thread, or right away if wait is set"""
+        if self.thread is not None and self.thread.is_alive():
+            if not wait:
+                return # The running flush picks up whatever is pending now
+            self.thread.join()
+
+        if wait:
+            self.write()
+        else:
+            self.thread = threading.Thread(target=self.write, name="stats-flush")
+            self.thread.start()
+
+    def write(self):
+        while True:
+            with self.lock:
+                (records, self.pending) = (self.pending, [])
+            if not records:
+                return
+
+            try:
+                self.append(b"".join(records), len(records))
+            except OSError:
+                pass # Losing stats is not worth interrupting the game for
+
+    def append(self, records, count):
+        mode = "r+b" if os.path.exists(self.filename) else "w+b"
+        with open(self.filename, mode) as file:
+            # Records past the count in the header are from an interrupted flush, overwrite them
+            file.seek(STATS_HEADER.size + self.record_count * STATS_RECORD.size)
+            file.write(records)
+            file.truncate()
+            self.record_count += count
+
+            file.seek(0)
+            file.write(STATS_HEADER.pack(STATS_MAGIC, STATS_VERSION, self.record_count,
+                                         self.runs, self.wins, self.total_coins, self.best_coins))
+
+    def close(self):
+        self.flush(wait=True)
+
+def read_history(filename=STATS_FILENAME):
+    """Returns every record as (time, event, map number, coins)"""
+    with open(filename, "rb") as file:
+        data = file.read()
+    (magic, version, record_count, *_) = STATS_HEADER.unpack_from(data)
+    if magic != STATS_MAGIC or version != STATS_VERSION:
+        raise ValueError(f"{filename} is not a stats file")
+    return list(STATS_RECORD.iter_unpack(data[STATS_HEADER.size : STATS_HEADER.size + record_count * STATS_RECORD.size]))
@@ -0,0 +1,52 @@
+import pygame
+from collections import OrderedDict
+
+from assets import registry
+
+DEFAULT_FONT = "assets/Minecraft.ttf"
+TEXT_CACHE_CAPACITY = 256 # Rendered strings kept around, least recently used ones are dropped first
+
+def get_font(size, filename=DEFAULT_FONT):
+    """Opens each font file once per size"""
+    return registry.get(("font", filename, size), lambda: pygame.font.Font(filename, size))
+
+class TextCache:
+    """Rendered text keyed by (text, size, colour, font), so that the same string is only rendered once.
+    The surfaces are shared, so they must never be drawn onto"""
+    def __init__(self, capacity=TEXT_CACHE_CAPACITY):
+        self.capacity = capacity
+        self.surfaces = OrderedDict() # Least recently used first
+
+    def render(self, text, size, color, filename=DEFAULT_FONT):
+        key = (text, size, tuple(pygame.Color(color)), filename) # "WHITE" and (255, 255, 255) are the same colour
+        surface = self.surfaces.get(key)
+        if surface is None:
+            surface = get_font(size, filename).render(text, True, color)
+            self.surfaces[key] = surface
+            if len(self.surfaces) > self.capacity:
+                self.surfaces.popitem(last=False)
+        else:
+            self.surfaces.move_to_end(key)
+        return surface
+
+text_cache = TextCache()
+
+def render_text(text, size, color, filename=DEFAULT_FONT):
+    return text_cache.render(text, size, color, filename)
+
+class HudText:
+    """A line of text showing a value, only rendered again when the value changes"""
+    def __init__(self, format, size, color, filename=DEFAULT_FONT):
+        self.format = format
+        self.font = get_font(size, filename)
+        self.color = color
+        self.value = None
+        self.surface = None
+
+    def set(self, value):
+        if self.surface is None or value != self.value:
+            self.value = value
+            self.surface = self.font.render(self.format.format(value), True, self.color)
+
+    def draw(self, surface, pos):
+        surface.blit(self.surface, pos)